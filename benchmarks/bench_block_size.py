@@ -0,0 +1,38 @@
+import time
+
+import numpy as np
+
+import mc_sim.simulation as mc
+import qf.pricing_util.option as opt
+import qf.pricing_util.payoff as pf
+
+from qf.models.cev import CEV_Opt
+from sde.cev_process import CEV
+
+"""
+Throughput of the streamed block run against the blocksize, stepped CEV process
+- small blocks pay the python overhead of every step, large blocks fall out of the cache, peak memory grows with
+  the blocksize (the values of a block at the cashflow times and one step of normals, drawn per step from the
+  generator of the block)
+Run from the repository root: python -m benchmarks.bench_block_size
+"""
+if __name__ == "__main__":
+    nb_simus = 2**18
+    instrument = CEV_Opt(spot=30.0,
+                         sig=0.2,
+                         beta=1.5,
+                         r=0.05,
+                         q=0.0,
+                         option=opt.EuropeanOption(pf.PayOffCall(strike=30.0), expiry=1.0)
+                         )
+    process = CEV(drift=instrument.Q_drift, vol=instrument.Q_vol, power=instrument.Power, nbSteps=100)
+    mapping = mc.SimMapping(process, instrument)
+
+    print(f"{nb_simus} paths, 100 steps")
+    print("{:>10} {:>10} {:>14} {:>12}".format('blocksize', 'seconds', 'paths/second', 'normals kB'))
+    for blocksize in [2**exponent for exponent in range(8, 19, 2)]:
+        config = mc.SimulationConfig(numberSimus=nb_simus, goal=0.0, blocksize=blocksize, checksims=blocksize, seed=1)
+        start = time.perf_counter()
+        mc.Simulation(simconfig=config, simmapping=mapping).run()
+        elapsed = time.perf_counter() - start
+        print(f"{blocksize:>10d} {elapsed:>10.3f} {nb_simus/elapsed:>14.0f} {blocksize*8/1e3:>12.1f}")
@@ -0,0 +1,39 @@
+import time
+
+import numpy as np
+
+import qf.pricing_util.option as opt
+import qf.pricing_util.payoff as pf
+
+from qf.models.cev import CEV_Opt
+from fdm.fdm import FDM_Generic_CEV
+from fdm.adaptive import FDM_Adaptive_CEV
+
+"""
+Grid picked by the adaptive driver against the fixed 300 x 300 Crank-Nicolson grid of the fdm notebook, CEV puts
+over spots and betas, sig scaled to a 20% vol at the strike
+- error against the analytical price (exact non-central chi-square backend)
+Run from the repository root: python -m benchmarks.bench_fdm_adaptive
+"""
+if __name__ == "__main__":
+    strike = 40.0
+    option = opt.EuropeanOption(pf.PayOffPut(strike=strike), expiry=0.5)
+
+    print("{:>7} {:>6} {:>9} {:>12} {:>10} {:>10} {:>10}".format('beta', 'spot', 'tolerance', 'grid', 'error', 'estimate', 'seconds'))
+    for beta in [1.9999, 1.0, 0.1]:
+        for spot in [30.0, 40.0, 50.0]:
+            instrument = CEV_Opt(spot=spot, sig=0.2*strike**(1.0 - beta/2.0), beta=beta, r=0.05, q=0.0, option=option,
+                                 cdf_tol=1e-12)
+            analytical = instrument.Analytical_NPV()
+
+            start = time.perf_counter()
+            engine = FDM_Generic_CEV(beta=beta, mkt_instrument=instrument, r=0.05, N=300, Nj=300, theta=0.5)
+            engine.rollback()
+            elapsed = time.perf_counter() - start
+            print(f"{beta:>7.4f} {spot:>6.1f} {'fixed':>9} {'300 x 300':>12} {abs(engine.result() - analytical):>10.2e} {'':>10} {elapsed:>10.3f}")
+
+            for tolerance in [1e-3, 1e-4, 1e-5]:
+                adaptive = FDM_Adaptive_CEV(beta=beta, mkt_instrument=instrument, r=0.05, tolerance=tolerance)
+                adaptive.rollback()
+                grid = f"{adaptive.Grid[0]} x {adaptive.Grid[1]}"
+                print(f"{beta:>7.4f} {spot:>6.1f} {tolerance:>9.0e} {grid:>12} {abs(adaptive.result() - analytical):>10.2e} {adaptive.ErrorEstimate:>10.2e} {adaptive.WallTime:>10.3f}")
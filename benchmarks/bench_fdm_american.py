@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+
+import qf.pricing_util.option as opt
+import qf.pricing_util.payoff as pf
+
+from qf.models.cev import CEV_Opt
+from fdm.fdm import FDM_Generic_CEV
+
+"""
+American CEV put, Brennan-Schwartz (one O(n) pass per step) against projected SOR on the same Crank-Nicolson
+system (sweeps of V(j) = max(g(j), V(j) + omega (Gauss-Seidel update - V(j))) until the update is below tol)
+- both solve the same discrete problem, the prices agree to the PSOR tolerance
+- PSOR needs more sweeps as the grid is refined (the spectral radius of the iteration goes to 1)
+Run from the repository root: python -m benchmarks.bench_fdm_american
+"""
+class PSOR_CEV(FDM_Generic_CEV):
+    def __init__(self, *args, omega = 1.5, tol = 1e-10, **kwargs):
+        self._omega = omega
+        self._tol = tol
+        self._sweeps = 0
+        FDM_Generic_CEV.__init__(self, *args, **kwargs)
+
+    def _solve_step(self, tridiag, key):
+        upper, main, lower = tridiag[0, 1:], tridiag[1, :], tridiag[2, :-1]
+        values = np.maximum(self._gridslice, self._intrinsic)
+        n = values.shape[0]
+        while True:
+            self._sweeps += 1
+            change = 0.0
+            for j in range(n):
+                residual = self._rhs[j]
+                if j > 0:
+                    residual -= lower[j - 1]*values[j - 1]
+                if j < n - 1:
+                    residual -= upper[j]*values[j + 1]
+                updated = max(self._intrinsic[j], values[j] + self._omega*(residual/main[j] - values[j]))
+                change = max(change, abs(updated - values[j]))
+                values[j] = updated
+            if change < self._tol:
+                return values
+
+if __name__ == "__main__":
+    option = opt.AmericanOption(pf.PayOffPut(strike=40.0), expiry=0.5)
+    instrument = CEV_Opt(spot=40.0, sig=0.2*40.0**0.25, beta=1.5, r=0.05, q=0.0, option=option)
+
+    print("{:>6} {:>6} {:>16} {:>16} {:>10} {:>10} {:>8}".format('N', 'Nj', 'Brennan-Schwartz', 'PSOR', 'BS sec', 'PSOR sec', 'sweeps'))
+    for N, Nj in [(25, 25), (50, 50), (100, 100)]:
+        start = time.perf_counter()
+        engine = FDM_Generic_CEV(beta=1.5, mkt_instrument=instrument, r=0.05, N=N, Nj=Nj, theta=0.5)
+        engine.rollback()
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        psor = PSOR_CEV(beta=1.5, mkt_instrument=instrument, r=0.05, N=N, Nj=Nj, theta=0.5)
+        psor.rollback()
+        elapsed_psor = time.perf_counter() - start
+        print(f"{N:>6d} {Nj:>6d} {engine.result():>16.10f} {psor.result():>16.10f} {elapsed:>10.4f} {elapsed_psor:>10.3f} {psor._sweeps/N:>8.1f}")
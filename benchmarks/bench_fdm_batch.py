@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+
+import qf.pricing_util.option as opt
+import qf.pricing_util.payoff as pf
+
+from qf.models.cev import CEV_Opt
+from fdm.fdm import FDM_Generic_CEV
+from fdm.batch import FDM_Batch_CEV
+
+"""
+Ladder of 500 CEV options (strikes 30 to 50, betas 0.5 to 1.9999, calls and puts), one engine and one rollback per
+option against the batched rollback
+- setup builds the engines (grids, payoffs, operators), the same work for both
+Run from the repository root: python -m benchmarks.bench_fdm_batch
+"""
+if __name__ == "__main__":
+    nb_options = 500
+    strikes = np.linspace(30.0, 50.0, nb_options)
+    betas = [0.5, 1.0, 1.5, 1.9999]
+    instruments = []
+    for m, strike in enumerate(strikes):
+        beta = betas[m % len(betas)]
+        payoff = pf.PayOffPut(strike=strike) if m % 2 else pf.PayOffCall(strike=strike)
+        instruments.append(CEV_Opt(spot=40.0, sig=0.2*40.0**(1.0 - beta/2.0), beta=beta, r=0.05, q=0.0,
+                                   option=opt.EuropeanOption(payoff, expiry=0.5)))
+
+    print(f"{nb_options} options")
+    print("{:>6} {:>6} {:>12} {:>12} {:>12} {:>10} {:>12}".format('N', 'Nj', 'setup', 'loop', 'batch', 'speedup', 'max diff'))
+    for N, Nj in [(50, 50), (100, 100), (300, 300)]:
+        start = time.perf_counter()
+        batch = FDM_Batch_CEV(instruments, r=0.05, N=N, Nj=Nj, theta=0.5)
+        setup = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for engine in batch.Engines:
+            engine.rollback()
+        prices_loop = np.array([engine.result() for engine in batch.Engines])
+        loop = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch.rollback()
+        prices_batch = batch.results()
+        batched = time.perf_counter() - start
+
+        print(f"{N:>6d} {Nj:>6d} {setup:>12.3f} {loop:>12.3f} {batched:>12.3f} {loop/batched:>10.1f} {np.max(np.abs(prices_batch - prices_loop)):>12.1e}")
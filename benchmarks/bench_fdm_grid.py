@@ -0,0 +1,35 @@
+import time
+
+import numpy as np
+
+import qf.pricing_util.option as opt
+import qf.pricing_util.payoff as pf
+
+from qf.models.cev import CEV_Opt
+from fdm.fdm import FDM_Generic_CEV
+
+"""
+Error of the Crank-Nicolson CEV put against the analytical price, uniform grid against the sinh grid concentrated
+at the strike, for the same number of space steps
+- the error is the largest over spots below, at and above the strike
+Run from the repository root: python -m benchmarks.bench_fdm_grid
+"""
+if __name__ == "__main__":
+    spots = [30.0, 40.0, 50.0]
+    instruments = [CEV_Opt(spot=spot, sig=0.2, beta=1.9999, r=0.05, q=0.0,
+                           option=opt.EuropeanOption(pf.PayOffPut(strike=40.0), expiry=0.5)) for spot in spots]
+    analytical = np.array([instrument.Analytical_NPV() for instrument in instruments])
+
+    print("{:>6} {:>8} {:>8} {:>12} {:>10}".format('Nj', 'grid', 'nodes', 'max error', 'seconds'))
+    for Nj in [10, 20, 40, 80, 160]:
+        for grid in ['uniform', 'sinh']:
+            start = time.perf_counter()
+            prices = []
+            for instrument in instruments:
+                engine = FDM_Generic_CEV(beta=instrument.Power*2.0, mkt_instrument=instrument, r=0.05, N=200, Nj=Nj,
+                                         theta=0.5, grid=grid)
+                engine.rollback()
+                prices.append(engine.result())
+            elapsed = time.perf_counter() - start
+            error = np.max(np.abs(np.array(prices) - analytical))
+            print(f"{Nj:>6d} {grid:>8} {engine.Nodes.shape[0]:>8d} {error:>12.2e} {elapsed:>10.3f}")
@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+
+import qf.pricing_util.option as opt
+import qf.pricing_util.payoff as pf
+
+from qf.models.cev import CEV_Opt
+from fdm.fdm import FDM_Generic_CEV
+from fdm.richardson import FDM_Richardson_CEV
+
+"""
+Cost to a price tolerance, brute Crank-Nicolson refinement (N = Nj doubled until the error meets the tolerance)
+against Richardson extrapolation over 2 and 3 levels with a Rannacher start
+- the error is the largest over spots below, at and above the strike, against the analytical price
+- cost in node steps (time steps x nodes) and wall time over the three spots, every method stops on the actual
+  error, the Richardson estimate is reported next to it (with 2 levels it bounds the finer level, not the
+  extrapolation)
+Run from the repository root: python -m benchmarks.bench_fdm_richardson
+"""
+if __name__ == "__main__":
+    spots = [30.0, 40.0, 50.0]
+    instruments = [CEV_Opt(spot=spot, sig=0.2, beta=1.9999, r=0.05, q=0.0,
+                           option=opt.EuropeanOption(pf.PayOffPut(strike=40.0), expiry=0.5)) for spot in spots]
+    analytical = np.array([instrument.Analytical_NPV() for instrument in instruments])
+
+    print("{:>9} {:>22} {:>12} {:>12} {:>12} {:>10}".format('tolerance', 'method', 'max error', 'estimate', 'node steps', 'seconds'))
+    for tolerance in [1e-3, 1e-4, 1e-5]:
+        n = 10
+        while True:
+            start = time.perf_counter()
+            prices = []
+            for instrument in instruments:
+                engine = FDM_Generic_CEV(beta=instrument.Power*2.0, mkt_instrument=instrument, r=0.05, N=n, Nj=n, theta=0.5)
+                engine.rollback()
+                prices.append(engine.result())
+            elapsed = time.perf_counter() - start
+            error = np.max(np.abs(np.array(prices) - analytical))
+            if error <= tolerance:
+                break
+            n *= 2
+        print(f"{tolerance:>9.0e} {'CN N = Nj = ' + str(n):>22} {error:>12.2e} {'':>12} {n*engine.Nodes.shape[0]:>12d} {elapsed:>10.3f}")
+
+        for levels in [2, 3]:
+            n = 5
+            while True:
+                start = time.perf_counter()
+                prices = []
+                estimates = []
+                for instrument in instruments:
+                    engine = FDM_Richardson_CEV(beta=instrument.Power*2.0, mkt_instrument=instrument, r=0.05, N=n, Nj=n, levels=levels)
+                    engine.rollback()
+                    prices.append(engine.result())
+                    estimates.append(engine.ErrorEstimate)
+                elapsed = time.perf_counter() - start
+                error = np.max(np.abs(np.array(prices) - analytical))
+                if error <= tolerance:
+                    break
+                n *= 2
+            label = f"Richardson {levels} x {n}"
+            print(f"{tolerance:>9.0e} {label:>22} {error:>12.2e} {max(estimates):>12.2e} {engine.Cost:>12d} {elapsed:>10.3f}")
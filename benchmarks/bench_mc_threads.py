@@ -0,0 +1,48 @@
+import os
+import time
+
+import mc_sim.simulation as mc
+import qf.pricing_util.option as opt
+import qf.pricing_util.payoff as pf
+
+from qf.models.cev import CEV_Opt
+from sde.cev_process import CEV
+from sde.gbm_process import SimGBM
+
+"""
+Wall time of the serial block run against the thread pool run, stepped CEV and GBM processes
+- the accuracy goal is set out of reach so every run simulates the full path budget
+Run from the repository root: python -m benchmarks.bench_mc_threads
+"""
+def build_mappings():
+    instrument = CEV_Opt(spot=30.0,
+                         sig=0.2,
+                         beta=1.5,
+                         r=0.05,
+                         q=0.0,
+                         option=opt.EuropeanOption(pf.PayOffCall(strike=30.0), expiry=1.0)
+                         )
+    return {'CEV': mc.SimMapping(CEV(drift=instrument.Q_drift, vol=instrument.Q_vol, power=instrument.Power), instrument),
+            'GBM': mc.SimMapping(SimGBM(drift=instrument.Q_drift, vol=instrument.Q_vol), instrument)}
+
+if __name__ == "__main__":
+    nb_simus = 400000
+    blocksize = 25000
+    thread_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+
+    print(f"{nb_simus} paths, blocks of {blocksize}, {os.cpu_count()} cpus")
+    print("{:<6} {:<10} {:>10} {:>10}".format('model', 'mode', 'seconds', 'speedup'))
+    for name, mapping in build_mappings().items():
+        config = mc.SimulationConfig(numberSimus=nb_simus, goal=0.0, blocksize=blocksize, checksims=blocksize, seed=1)
+        start = time.perf_counter()
+        mc.Simulation(simconfig=config, simmapping=mapping).run()
+        serial = time.perf_counter() - start
+        print(f"{name:<6} {'serial':<10} {serial:>10.3f} {1.0:>10.2f}")
+
+        for threads in thread_counts:
+            config = mc.SimulationConfig(numberSimus=nb_simus, goal=0.0, blocksize=blocksize, checksims=blocksize,
+                                         threads=threads, seed=1)
+            start = time.perf_counter()
+            mc.Simulation(simconfig=config, simmapping=mapping).run()
+            elapsed = time.perf_counter() - start
+            print(f"{name:<6} {str(threads) + ' threads':<10} {elapsed:>10.3f} {serial/elapsed:>10.2f}")
@@ -0,0 +1,32 @@
+import time
+import numpy as np
+
+from qf.models.nc_chi_squ import NC_CHI_SQU_CDF_BACKENDS, nc_chi_squ_cdf, nc_chi_squ_cdf_series
+
+"""
+Accuracy and throughput of the non-central chi-square cdf backends over a (z, k, v) grid covering the CEV pricing
+formula for 0 < beta < 2
+- k is 2/(2 - beta) or 2 + 2/(2 - beta), v is log-spaced, z is spread around the mean k + v
+- the reference is the series backend at tol = 1e-15
+Run from the repository root: python -m benchmarks.bench_nc_chi_squ_cdf
+"""
+def cev_grid(nb_points: int, seed = 0):
+    rng = np.random.default_rng(seed)
+    beta = rng.uniform(0.05, 1.99, nb_points)
+    k = np.where(rng.random(nb_points) < 0.5, 2.0/(2.0 - beta), 2.0 + 2.0/(2.0 - beta))
+    v = np.exp(rng.uniform(np.log(0.1), np.log(2000.0), nb_points))
+    z = (k + v)*np.exp(rng.normal(0.0, 0.5, nb_points))
+    return z, k, v
+
+if __name__ == "__main__":
+    z, k, v = cev_grid(100000)
+    exact = nc_chi_squ_cdf_series(z, k, v, tol=1e-15)
+
+    print("{:<10} {:>10} {:>15} {:>15} {:>18}".format('backend', 'tol', 'max abs err', 'mean abs err', 'evals per second'))
+    for backend in NC_CHI_SQU_CDF_BACKENDS:
+        for tol in ([1e-6, 1e-12] if backend == 'series' else [1e-12]):
+            start = time.perf_counter()
+            cdf = nc_chi_squ_cdf(z, k, v, backend=backend, tol=tol)
+            elapsed = time.perf_counter() - start
+            error = np.abs(cdf - exact)
+            print(f"{backend:<10} {tol:>10.0e} {np.max(error):>15.2e} {np.mean(error):>15.2e} {z.shape[0]/elapsed:>18,.0f}")
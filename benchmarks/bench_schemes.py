@@ -0,0 +1,34 @@
+import time
+import numpy as np
+
+from qf.models.cev import cev_analytical_npv
+from sde.cev_process import CEV
+from sde.scheme import Euler, LogEuler, Milstein
+
+"""
+Weak convergence of the discretisation schemes for the CEV process: bias of a European call against the analytical
+price, and wall time, as the number of steps grows
+- every scheme uses the same seed for a given number of steps (common random numbers)
+- the standard error column tells which biases are resolved by the path count
+Run from the repository root: python -m benchmarks.bench_schemes
+"""
+if __name__ == "__main__":
+    S0, K, T, r, beta = 30.0, 30.0, 1.0, 0.05, 1.0
+    sig = 0.4*(S0**(1.0 - beta/2.0))
+    nb_paths = 400000
+    analytical = cev_analytical_npv('call', S0, K, T, sig, beta, r, 0.0, cdf_backend='scipy')
+
+    schemes = {'euler': Euler(boundary='absorb'),
+               'log-euler': LogEuler(),
+               'milstein': Milstein(boundary='absorb')}
+
+    print(f"CEV beta = {beta}, call S0 = K = {S0}, T = {T}, analytical = {analytical:.5f}, {nb_paths} paths")
+    print("{:<10} {:>6} {:>10} {:>10} {:>10}".format('scheme', 'steps', 'bias', 'std err', 'seconds'))
+    for name, scheme in schemes.items():
+        for nb_steps in [1, 2, 4, 8, 16, 32]:
+            process = CEV(drift=r, vol=sig, power=beta/2.0, scheme=scheme, nbSteps=nb_steps)
+            start = time.perf_counter()
+            times, X_t = process.Xt_paths(S0, np.array([T]), nb_paths, np.random.default_rng(nb_steps))
+            payoff = np.exp(-r*T)*np.maximum(X_t[:, -1] - K, 0.0)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<10} {nb_steps:>6} {np.mean(payoff) - analytical:>10.5f} {np.std(payoff)/np.sqrt(nb_paths):>10.5f} {elapsed:>10.3f}")
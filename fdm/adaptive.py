@@ -0,0 +1,135 @@
+import math
+import time
+import numpy as np
+
+from qf.models.mkt_instrument_base import MktInstrument
+from fdm.fdm import FDM_Generic_CEV
+
+"""
+FDM price of the CEV instrument to a price tolerance, the time and the space grid are refined separately
+- at a grid (N, Nj) the engine is also solved on (2N, Nj) and (N, 2Nj), with second order in dt and in dx the
+  error of V(N, Nj) splits into
+      e_t = 4/3 (V(N, Nj) - V(2N, Nj)),  e_x = 4/3 (V(N, Nj) - V(N, 2Nj))
+- the price is V(2N, Nj) + V(N, 2Nj) - V(N, Nj), the (2N, 2Nj) solution to leading order, with the error estimate
+  (|e_t| + |e_x|)/4
+- while the estimate is above the tolerance each direction is scaled so its part of the error of V(N, Nj) falls
+  to half the tolerance, N' = N sqrt(2|e_t|/tolerance) (between 1 and maxFactor times N), the same for Nj
+- solves are cached by grid, V(N, 2Nj) is reused when the next grid is (N, 2Nj)
+- the estimate is asymptotic, the starting grid should resolve the payoff around the spot (N = Nj = 20 does for
+  spots within the strike +-25%)
+
+The engines run with a Rannacher start, the cell averaged payoff and the sinh grid by default (the error then falls
+smoothly as h^2), any FDM_Generic_CEV argument can be passed through engine_kwargs.
+"""
+class FDM_Adaptive_CEV:
+    def __init__(self,
+                beta,
+                mkt_instrument: MktInstrument,
+                r,
+                tolerance,
+                N = 20,
+                Nj = 20,
+                maxFactor = 4.0,
+                maxNodeSteps = 10**8,
+                theta = 0.5,
+                rannacher_steps = 2,
+                debug = False,
+                **engine_kwargs
+                ):
+        self._cev_beta = beta
+        self._mkt_instrument = mkt_instrument
+        self._r = r
+        self._tolerance = tolerance
+        self._N = N
+        self._Nj = Nj
+        self._maxFactor = maxFactor
+        self._maxNodeSteps = maxNodeSteps
+        self._theta = theta
+        self._rannacher_steps = rannacher_steps
+        self._debug = debug
+        self._engine_kwargs = {'grid': 'sinh', 'average_payoff': True}
+        self._engine_kwargs.update(engine_kwargs)
+        self._solves = {}
+        self._history = []
+        self._price = None
+        self._errorEstimate = math.inf
+        self._wallTime = 0.0
+
+        assert self._tolerance > 0.0, f"tolerance must be > 0, input was {self._tolerance}"
+        assert self._maxFactor > 1.0, f"maxFactor must be > 1, input was {self._maxFactor}"
+
+    #(N, Nj) of the last base grid
+    @property
+    def Grid(self):
+        return (self._N, self._Nj)
+
+    @property
+    def ErrorEstimate(self):
+        return self._errorEstimate
+
+    @property
+    def WallTime(self):
+        return self._wallTime
+
+    @property
+    def NbSolves(self):
+        return len(self._solves)
+
+    #time steps x nodes summed over all solves
+    @property
+    def Cost(self):
+        return sum(node_steps for _, node_steps in self._solves.values())
+
+    """One row per base grid: N, Nj, price, time error, space error (of V(N, Nj))
+    """
+    @property
+    def History(self):
+        return np.array(self._history)
+
+    def _solve(self, N: int, Nj: int):
+        if (N, Nj) not in self._solves:
+            engine = FDM_Generic_CEV(beta=self._cev_beta, mkt_instrument=self._mkt_instrument, r=self._r, N=N, Nj=Nj,
+                                     theta=self._theta, rannacher_steps=min(self._rannacher_steps, N), **self._engine_kwargs)
+            engine.rollback()
+            self._solves[(N, Nj)] = (engine.result(), N*engine.Nodes.shape[0])
+        return self._solves[(N, Nj)][0]
+
+    #grid size scaling an error e to half the tolerance
+    def _refined(self, n: int, error: float):
+        factor = math.sqrt(2.0*abs(error)/self._tolerance)
+        return int(math.ceil(n*min(max(factor, 1.0), self._maxFactor)))
+
+    """Refines until the error estimate meets the tolerance or the next grid would exceed maxNodeSteps,
+    returns True if the tolerance was met
+    """
+    def rollback(self):
+        start = time.perf_counter()
+        converged = False
+        while True:
+            N, Nj = self._N, self._Nj
+            price = self._solve(N, Nj)
+            price_t = self._solve(2*N, Nj)
+            price_x = self._solve(N, 2*Nj)
+            error_t = 4.0/3.0*(price - price_t)
+            error_x = 4.0/3.0*(price - price_x)
+            self._price = price_t + price_x - price
+            self._errorEstimate = 0.25*(abs(error_t) + abs(error_x))
+            self._history.append([N, Nj, price, error_t, error_x])
+            if self._debug:
+                print(f"N {N} Nj {Nj} price {self._price:.8f} time error {error_t:.2e} space error {error_x:.2e}")
+
+            if self._errorEstimate <= self._tolerance:
+                converged = True
+                break
+            next_N, next_Nj = self._refined(N, error_t), self._refined(Nj, error_x)
+            if (next_N, next_Nj) == (N, Nj):
+                next_N, next_Nj = 2*N, 2*Nj
+            #the next base grid costs about 4 times its own node steps (base plus the two refined solves)
+            if 4*next_N*(2*next_Nj + 1) > self._maxNodeSteps:
+                break
+            self._N, self._Nj = next_N, next_Nj
+        self._wallTime = time.perf_counter() - start
+        return converged
+
+    def result(self):
+        return self._price
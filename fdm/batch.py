@@ -0,0 +1,128 @@
+import numpy as np
+from scipy.linalg.lapack import dgttrf, dgttrs
+
+from fdm.fdm import FDM_Generic_CEV
+
+"""
+Batch of independent CEV PDEs (a ladder of strikes, betas, vols, expiries, calls and puts) rolled back together
+- each instrument gets its own FDM_Generic_CEV engine for the grid, the difference weights, the payoff slice and
+  the scheme coefficients, the batch only takes over the time loop
+- the M tridiagonal systems are stacked along the diagonal into one tridiagonal system of size sum(n_m), the
+  boundary rows are identity rows so the blocks do not couple
+- the operator does not change between time steps, the stacked system is LU factored once (LAPACK gttrf) and every
+  time step is a single O(sum(n_m)) solve with the factors (gttrs) for the whole batch
+- the explicit side, the Rannacher half steps and the boundary conditions are numpy operations on the stacked
+  slices, the python loop runs N times for the batch instead of N times per instrument
+- every instrument is stepped with its own dt = T/N, all take the same N (the grids may differ in size)
+
+Only time homogeneous engines (the CEV local vol) and European options are batched. The prices agree with the engines rolled back one by
+one to rounding.
+"""
+class FDM_Batch_CEV:
+    def __init__(self,
+                mkt_instruments,
+                r,
+                N,
+                Nj,
+                theta,
+                betas = None,
+                **engine_kwargs
+                ):
+        self._mkt_instruments = list(mkt_instruments)
+        nbInstruments = len(self._mkt_instruments)
+        betas = [instrument.Power*2.0 for instrument in self._mkt_instruments] if betas is None else betas
+        rates = np.broadcast_to(np.asarray(r, dtype=float), (nbInstruments,))
+        self._N = N
+        self._engines = [FDM_Generic_CEV(beta=beta, mkt_instrument=instrument, r=rate, N=N, Nj=Nj, theta=theta, **engine_kwargs)
+                         for instrument, beta, rate in zip(self._mkt_instruments, betas, rates)]
+
+        assert all(engine.TimeHomogeneous for engine in self._engines), "only time homogeneous engines can be batched"
+        assert all(engine.ExerciseStyle == 'european' for engine in self._engines), "only European options can be batched"
+
+        sizes = np.array([engine.Nodes.shape[0] for engine in self._engines])
+        self._offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self._first = self._offsets[:-1]
+        self._last = self._offsets[1:] - 1
+        boundary = np.concatenate([self._first, self._last])
+
+        def stacked(values):
+            return np.concatenate(values)
+
+        #explicit weights with the boundary rows copying the slice, (0, 1, 0)
+        self._gridslice = stacked([engine._gridslice for engine in self._engines])
+        self._alpha = stacked([engine._alpha for engine in self._engines])
+        self._beta = stacked([engine._beta for engine in self._engines])
+        self._gamma = stacked([engine._gamma for engine in self._engines])
+        self._alpha[boundary] = 0.0
+        self._beta[boundary] = 1.0
+        self._gamma[boundary] = 0.0
+        self._min_BC = np.repeat([engine._min_BC for engine in self._engines], sizes)
+        self._max_BC = np.repeat([engine._max_BC for engine in self._engines], sizes)
+        self._factors = self._factorise(np.concatenate([engine._tridiag for engine in self._engines], axis=1))
+
+        #Rannacher half steps, (1/(dt/2) - L) V(t) = V(t + dt/2)/(dt/2) on the interior rows
+        self._rannacher_steps = self._engines[0]._rannacher_steps
+        self._implicit_factors = None
+        if self._rannacher_steps > 0:
+            tridiags = []
+            for engine in self._engines:
+                l_minus, l_centre, l_plus = engine._operator(engine._T)
+                tridiags.append(engine._banded(-l_minus, 2.0/engine._dt - l_centre, -l_plus))
+            self._implicit_factors = self._factorise(np.concatenate(tridiags, axis=1))
+            self._half_step_scale = np.repeat([2.0/engine._dt for engine in self._engines], sizes)
+            self._half_step_scale[boundary] = 1.0
+        self._rhs = np.zeros(self._offsets[-1])
+
+    @property
+    def NbInstruments(self):
+        return len(self._engines)
+
+    @property
+    def Engines(self):
+        return self._engines
+
+    #stacked boundary conditions, linear extrapolation then the bounds of each instrument
+    def _applyBC(self):
+        self._gridslice[self._first] = 2.0*self._gridslice[self._first + 1] - self._gridslice[self._first + 2]
+        self._gridslice[self._last] = 2.0*self._gridslice[self._last - 1] - self._gridslice[self._last - 2]
+        np.clip(self._gridslice, self._min_BC, self._max_BC, out=self._gridslice)
+        return
+
+    #LU factors of a banded (LAPACK layout) tridiagonal matrix
+    @staticmethod
+    def _factorise(tridiag):
+        dl, d, du, du2, ipiv, info = dgttrf(tridiag[2, :-1], tridiag[1, :], tridiag[0, 1:])
+        assert info == 0, f"singular batch operator, LAPACK gttrf info {info}"
+        return (dl, d, du, du2, ipiv)
+
+    def _solve(self, factors):
+        self._gridslice, info = dgttrs(*factors, self._rhs)
+        self._applyBC()
+        return
+
+    def _update_rhs(self):
+        sol = self._gridslice
+        np.multiply(self._beta, sol, out=self._rhs)
+        self._rhs[1:] += self._alpha[1:]*sol[:-1]
+        self._rhs[:-1] += self._gamma[:-1]*sol[1:]
+        return
+
+    def rollback(self):
+        for i in range(self._N, 0, -1):
+            if i > self._N - self._rannacher_steps:
+                for _ in range(2):
+                    np.multiply(self._half_step_scale, self._gridslice, out=self._rhs)
+                    self._solve(self._implicit_factors)
+                continue
+            self._update_rhs()
+            self._solve(self._factors)
+        return
+
+    #t = 0 slice of instrument m
+    def gridslice(self, m: int):
+        return self._gridslice[self._offsets[m]:self._offsets[m + 1]]
+
+    #price of every instrument at its spot, linear interpolation as FDM_Generic_CEV.result
+    def results(self):
+        return np.array([np.interp(instrument.Spot, engine.Nodes, self.gridslice(m))
+                         for m, (instrument, engine) in enumerate(zip(self._mkt_instruments, self._engines))])
@@ -0,0 +1,74 @@
+import numpy as np
+from scipy.linalg import solve_banded
+
+"""
+Brennan-Schwartz solve of the tridiagonal system A V = d under the early exercise constraint V >= g
+- Brennan, M. J. and Schwartz, E. S. (1977), 'The Valuation of American Put Options', Journal of Finance 32, 449-462
+- the exercise region is one interval at an end of the grid, [0, S*] for a put and [S*, max] for a call
+- the elimination runs from the continuation end towards the exercise end (A = U L for a put), the substitution then
+  starts in the exercise region and takes V = max(continuation, g) node by node, one pass, O(n) like the unconstrained
+  solve and exact for the discrete problem when the exercise region is an interval (no PSOR iterations)
+- with a contiguous exercise region the substitution is V = g up to the first node where the continuation value
+  exceeds g and the plain linear recurrence past it, both steps are vectorised (the recurrence is a bidiagonal
+  LAPACK solve)
+
+The matrix is in the banded layout of the FDM engine (row 0 upper, row 1 main, row 2 lower diagonal). For a call
+the system is solved reversed, the exercise end is then again the start of the arrays.
+"""
+
+"""UL factors of the banded matrix, eliminating the upper diagonal from the last row up
+    b'(n-1) = b(n-1),  m(j) = c(j)/b'(j+1),  b'(j) = b(j) - m(j) a(j+1)
+returns (m, b', a/b'), the system becomes a(j) V(j-1) + b'(j) V(j) = d'(j) with d'(j) = d(j) - m(j) d'(j+1)
+"""
+def brennan_schwartz_factors(tridiag: np.ndarray, exercise_low: bool = True):
+    upper = tridiag[0, 1:]
+    main = tridiag[1, :]
+    lower = tridiag[2, :-1]
+    if not exercise_low:
+        upper, main, lower = lower[::-1], main[::-1], upper[::-1]
+    n = main.shape[0]
+    main_ul = np.empty(n)
+    multiplier = np.empty(n - 1)
+    main_ul[-1] = main[-1]
+    for j in range(n - 2, -1, -1):
+        multiplier[j] = upper[j]/main_ul[j + 1]
+        main_ul[j] = main[j] - multiplier[j]*lower[j]
+    #a(j)/b'(j), zero on row 0
+    lower_ratio = np.concatenate([[0.0], lower/main_ul[1:]])
+    return (multiplier, main_ul, lower_ratio, exercise_low)
+
+"""V = max(continuation, payoff) solving the factored system, returns V and the number of nodes at the exercise end
+of the grid in the exercise region (the boundary row counts as one)
+"""
+def brennan_schwartz_solve(factors, rhs: np.ndarray, payoff: np.ndarray):
+    multiplier, main_ul, lower_ratio, exercise_low = factors
+    if not exercise_low:
+        rhs = rhs[::-1]
+        payoff = payoff[::-1]
+    n = rhs.shape[0]
+
+    #d' from the unit upper bidiagonal system, then V(j) = y(j) - l(j) V(j-1)
+    unit_upper = np.ones((2, n))
+    unit_upper[0, 1:] = multiplier
+    y = solve_banded((0, 1), unit_upper, rhs, check_finite=False)/main_ul
+
+    #continuation value with the previous node exercised, row 0 is the boundary row (V(0) = max(d(0), g(0)) whatever
+    #its neighbours do) and is left out of the search for the free boundary
+    previous = np.array(payoff[:-1], dtype=float)
+    previous[0] = max(y[0], payoff[0])
+    continuation = y - lower_ratio*np.concatenate([[0.0], previous])
+    continued = continuation[1:] >= payoff[1:]
+    nbExercised = 1 + int(np.argmax(continued)) if np.any(continued) else n
+
+    values = np.array(payoff, dtype=float)
+    values[0] = previous[0]
+    if nbExercised < n:
+        unit_lower = np.ones((2, n - nbExercised))
+        unit_lower[1, :-1] = lower_ratio[nbExercised + 1:]
+        tail = y[nbExercised:].copy()
+        tail[0] = continuation[nbExercised]
+        values[nbExercised:] = solve_banded((1, 0), unit_lower, tail, check_finite=False)
+
+    if not exercise_low:
+        values = values[::-1]
+    return values, nbExercised
@@ -1,8 +1,12 @@
 import math
 import numpy as np
+from scipy.interpolate import CubicSpline
+from scipy.linalg import solve_banded
 from scipy.stats import norm
 
 from qf.models.mkt_instrument_base import MktInstrument
+from qf.models.cev import cev_upper_quantile
+from fdm.exercise import brennan_schwartz_factors, brennan_schwartz_solve
 
 """
 Application of a generic FDM applied to a parabolic PDE (Cauchy problem)
@@ -14,6 +18,42 @@ http://web.math.ku.dk/~rolf/teaching/ctff03/project2.pdf
 
 See this paper for numerical method implementation specifically for CEV
 http://pdf.xuebalib.com:1262/xuebalib.com.37179.pdf
+
+The system is tridiagonal, only the three diagonals are stored (LAPACK banded layout) and each
+time step is an O(Nj) banded solve
+- row 0 is the upper diagonal, row 1 the main diagonal, row 2 the lower diagonal
+- the boundary rows carry the linearly extrapolated boundary values of the previous time slice
+
+The spatial grid, the local vol and the six scheme coefficients are numpy arrays over the grid. When the
+coefficients do not depend on t (_mu_func and _sig_func not overridden) the operator is assembled once and
+reused at every time step.
+
+Spatial grid
+- the far boundary is the level the CEV underlying ends above with probability tail_prob (and at least 1.5 times
+  the strike and the largest spot), the near boundary is zero
+- grid = 'uniform': equal steps, centred on the spot for a single spot (nodes below zero are dropped)
+- grid = 'sinh': nodes concentrate around the strike, where the payoff has its kink, and around the spot, where the
+  price is read. xi(x) = arcsinh((x - K)/c) + w*arcsinh((x - S0)/c) is uniform over the nodes (node density
+  1/sqrt(c^2 + (x - K)^2) + w/sqrt(c^2 + (x - S0)^2)), c = concentration*K sets the width of the fine regions and
+  w = spot_weight the share of the spot. w = 0 (or S0 = K) is the one centre map x = K + c*sinh(xi). The nodes at
+  the spot are taken from the strike, the default 0.5 balances the two. The map is inverted by bisection
+- the derivatives use the three point formulas for unequal spacing, exact for quadratics on any grid
+
+Rannacher start
+- the kink of the payoff excites high frequency modes that Crank-Nicolson does not damp, the price and the Greeks
+  near the strike oscillate and the convergence in dt drops below second order
+- rannacher_steps > 0 replaces the first time steps from maturity by two fully implicit half steps each, which damp
+  the kink, the remaining steps use theta
+- average_payoff = True starts from the payoff averaged over the cell of each node (split at the strike, exact for
+  calls and puts), the kink then gives an error that falls smoothly as h^2 and can be extrapolated (Richardson)
+
+Early exercise, from the ExerciseStyle of the option of the instrument
+- american: every step is solved under V >= payoff with the O(n) Brennan-Schwartz solve (fdm/exercise.py), the
+  implicit Rannacher half steps as well
+- bermudan: V = max(V, payoff) on the steps at the exercise times (before the expiry), the times must fall on the
+  time steps t = i dt (within 1e-6 of a step)
+- ExerciseBoundary gives the exercise boundary per time step, the exercised node next to the continuation region
+  (NaN when the payoff raised no interior node)
 """
 
 class FDM_Generic_CEV:
@@ -23,7 +63,14 @@ class FDM_Generic_CEV:
                 r,
                 N,
                 Nj,
-                theta
+                theta,
+                spots = None,
+                grid = 'uniform',
+                concentration = 0.1,
+                spot_weight = 0.5,
+                tail_prob = 1e-8,
+                rannacher_steps = 0,
+                average_payoff = False
                 ):
         self._mkt_instrument = mkt_instrument
         self._spot = self._mkt_instrument.Spot
@@ -36,15 +83,37 @@ class FDM_Generic_CEV:
         self._Nj = Nj
         self._theta = theta
         self._dt = self._T/self._N
+        self._rannacher_steps = rannacher_steps
+        self._average_payoff = average_payoff
+        self._grid = grid
+        self._concentration = concentration
+        self._spot_weight = spot_weight
         self._min_underlying = 0
-        self._max_underlying = 2*self._K
+        max_spot = self._spot if spots is None else np.max(spots)
+        self._max_underlying = max(cev_upper_quantile(tail_prob, max_spot, self._T, self._sig, self._cev_beta, self._r),
+                                   1.5*self._K, 1.5*max_spot)
+        #a single spot centres a uniform grid on the spot, a range of spots on the middle of the grid
+        self._centre = self._spot if spots is None else 0.5*self._max_underlying
         self._max_BC = self._mkt_instrument.PayOff(self._max_underlying) if self._mkt_instrument.PayOff(self._max_underlying) > 0  else self._mkt_instrument.PayOff(self._min_underlying)
         self._min_BC = 0
-        self._dx = (self._max_underlying - self._spot)/self._Nj
-        self._sol = np.zeros(2*self._Nj + 1)
-        self._rhs = np.zeros(2*self._Nj + 1)
+
+        assert self._grid in ['uniform', 'sinh'], f"grid must be 'uniform' or 'sinh', input was {self._grid}"
+        assert self._spot_weight >= 0.0, f"spot_weight must be >= 0, input was {self._spot_weight}"
+        assert (self._rannacher_steps >= 0) & (self._rannacher_steps <= self._N), f"rannacher_steps must be in [0, N], input was {self._rannacher_steps}"
+
+        self._Xj = self._build_grid()
+        self._sol = np.zeros(self._Xj.shape[0])
+        self._rhs = np.zeros(self._Xj.shape[0])
+        self._initialise_difference_weights()
         self._initialise_tN_slide()
         self._update_tridiag(self._T)
+        self._implicit_tridiag = None
+        self._initialise_exercise()
+
+    #True if the PDE coefficients are constant in time, the operator is then only built once
+    @property
+    def TimeHomogeneous(self):
+        return (type(self)._mu_func is FDM_Generic_CEV._mu_func) and (type(self)._sig_func is FDM_Generic_CEV._sig_func)
 
     def _applyBC(self):
         self._gridslice[0] = 2.0*self._gridslice[1] - self._gridslice[2]
@@ -53,91 +122,233 @@ class FDM_Generic_CEV:
         self._gridslice[self._gridslice > self._max_BC ] =  self._max_BC
         return
 
-    def _Xj_applyConstraints(self, j: float):
-        x = self._spot - self._Nj*self._dx + self._dx*j
-        if x < self._min_underlying:
-            x = self._min_underlying
-        elif x > self._max_underlying:
-            x = self._max_underlying
-        return x
+    @property
+    def Nodes(self):
+        return self._Xj
+
+    @property
+    def ExerciseStyle(self):
+        return self._exercise_style
+
+    """(times, levels) of the exercise boundary at the time steps 0, dt, .., T - dt of the last rollback
+    """
+    @property
+    def ExerciseBoundary(self):
+        return self._dt*np.arange(self._N), self._exercise_boundary
+
+    def _Xj_applyConstraints(self, j: np.ndarray):
+        x = self._centre - self._Nj*self._dx + self._dx*j
+        return np.clip(x, self._min_underlying, self._max_underlying)
+
+    #2*Nj + 1 nodes from the near to the far boundary, clipped uniform nodes that collapse onto zero are dropped
+    def _build_grid(self):
+        if self._grid == 'sinh':
+            c = self._concentration*self._K
+            def xi_of(x):
+                return np.arcsinh((x - self._K)/c) + self._spot_weight*np.arcsinh((x - self._spot)/c)
+            xi = np.linspace(xi_of(self._min_underlying), xi_of(self._max_underlying), 2*self._Nj + 1)
+            #xi is increasing in x, bisection to the last bit
+            lower = np.full(xi.shape[0], float(self._min_underlying))
+            upper = np.full(xi.shape[0], float(self._max_underlying))
+            for _ in range(0, 100):
+                x = 0.5*(lower + upper)
+                below = xi_of(x) < xi
+                lower = np.where(below, x, lower)
+                upper = np.where(below, upper, x)
+            x = 0.5*(lower + upper)
+            x[0] = self._min_underlying
+            x[-1] = self._max_underlying
+            return x
+        self._dx = (self._max_underlying - self._centre)/self._Nj
+        return np.unique(self._Xj_applyConstraints(np.arange(0, 2*self._Nj + 1)))
+
+    """Weights of V(j-1), V(j), V(j+1) in the first (d1) and second (d2) derivative at each node, with
+    h- = x(j) - x(j-1) and h+ = x(j+1) - x(j)
+        d1 = [-h+/(h-(h- + h+)), (h+ - h-)/(h- h+), h-/(h+(h- + h+))]
+        d2 = [2/(h-(h- + h+)), -2/(h- h+), 2/(h+(h- + h+))]
+    the boundary nodes reuse the spacing of their neighbour, their rows are replaced by the boundary conditions
+    """
+    def _initialise_difference_weights(self):
+        h = np.diff(self._Xj)
+        h_minus = np.concatenate([[h[0]], h])
+        h_plus = np.concatenate([h, [h[-1]]])
+        h_sum = h_minus + h_plus
+        self._d1 = (-h_plus/(h_minus*h_sum), (h_plus - h_minus)/(h_minus*h_plus), h_minus/(h_plus*h_sum))
+        self._d2 = (2.0/(h_minus*h_sum), -2.0/(h_minus*h_plus), 2.0/(h_plus*h_sum))
+        return
 
     def _initialise_tN_slide(self):
-        self._gridslice = np.zeros(2*self._Nj + 1)
-        tN_underlying = np.array([self._Xj_applyConstraints(j) for j in  range(0,2*self._Nj + 1)])
-        for j in range(0, 2 * self._Nj + 1):
-            self._gridslice[j] = self._mkt_instrument.PayOff(tN_underlying[j])
+        if self._average_payoff:
+            self._gridslice = self._cell_average_payoff()
+        else:
+            self._gridslice = np.array(self._mkt_instrument.PayOff(self._Xj), dtype=float)
         self._applyBC()
         return
 
+    #payoff averaged over [x(j-1/2), x(j+1/2)], two point Gauss-Legendre on either side of the strike
+    def _cell_average_payoff(self):
+        midpoints = 0.5*(self._Xj[1:] + self._Xj[:-1])
+        lower = np.concatenate([[self._Xj[0]], midpoints])
+        upper = np.concatenate([midpoints, [self._Xj[-1]]])
+        kink = np.clip(self._K, lower, upper)
+        nodes = np.array([0.5 - 0.5/math.sqrt(3.0), 0.5 + 0.5/math.sqrt(3.0)])
+        total = np.zeros(self._Xj.shape[0])
+        for start, end in [(lower, kink), (kink, upper)]:
+            points = start[:, None] + (end - start)[:, None]*nodes[None, :]
+            total += 0.5*(end - start)*np.sum(np.array(self._mkt_instrument.PayOff(points), dtype=float), axis=1)
+        return total/(upper - lower)
+
+    #drift of the underlying, dS = mu(S,t)dt + sig(S,t)dW
     def _mu_func(self, x,t):
-        return self._r
+        return self._r*x
 
     def _sig_func(self, x,t):
         return self._sig*(x**(self._cev_beta/2.0))
 
-    def _a(self, x,t):
-        mu = self._mu_func(x,t)
-        sig = self._sig_func(x,t)
-        return (1.0-self._theta)*(mu - sig*sig/self._dx)/(2.0*self._dx)
+    """Scheme coefficients on the whole grid at time t
+    - a, b, c weight V(j-1), V(j), V(j+1) on the implicit side
+    - alpha, beta, gamma weight V(j-1), V(j), V(j+1) on the explicit side
+    """
+    def _update_coefficients(self, t):
+        l_minus, l_centre, l_plus = self._operator(t)
+        implicit = 1.0 - self._theta
+        explicit = self._theta
+        self._a = -implicit*l_minus
+        self._b = 1.0/self._dt - implicit*l_centre
+        self._c = -implicit*l_plus
+        self._alpha = explicit*l_minus
+        self._beta = 1.0/self._dt + explicit*l_centre
+        self._gamma = explicit*l_plus
+        return
 
-    def _b(self, x,t):
-        sig = self._sig_func(x,t)
-        return 1.0/self._dt + (1.0-self._theta)*(self._r +  sig*sig/(self._dx**2))
+    #operator L V = mu V' + sig^2/2 V'' - r V, weights of V(j-1), V(j), V(j+1)
+    def _operator(self, t):
+        mu = self._mu_func(self._Xj,t)*np.ones(self._Xj.shape[0])
+        sig = self._sig_func(self._Xj,t)
+        half_sig2 = 0.5*sig*sig
+        return (mu*self._d1[0] + half_sig2*self._d2[0],
+                mu*self._d1[1] + half_sig2*self._d2[1] - self._r,
+                mu*self._d1[2] + half_sig2*self._d2[2])
+
+    #banded matrix with identity boundary rows
+    def _banded(self, a, b, c):
+        tridiag = np.zeros(shape = (3, self._Xj.shape[0]))
+        tridiag[1, 0] = 1.0
+        tridiag[1, -1] = 1.0
+        tridiag[2, :-2] = a[1:-1]
+        tridiag[1, 1:-1] = b[1:-1]
+        tridiag[0, 2:] = c[1:-1]
+        return tridiag
 
-    def _c(self, x,t):
-        mu = self._mu_func(x,t)
-        sig = self._sig_func(x,t)
-        return (1.0 - self._theta)*(-mu - sig*sig/self._dx)/(2.0*self._dx)
+    def _update_tridiag(self, t):
+        self._update_coefficients(t)
+        self._tridiag = self._banded(self._a, self._b, self._c)
+        return
 
-    def _alpha(self, x,t):
-        mu = self._mu_func(x,t)
-        sig = self._sig_func(x,t)
-        return -self._theta*(mu - sig*sig/self._dx)/(2.0*self._dx)
+    #fully implicit step of dt/2 ending at t, (1/(dt/2) - L) V(t) = V(t + dt/2)/(dt/2)
+    def _implicit_half_step(self, t):
+        if (self._implicit_tridiag is None) or not self.TimeHomogeneous:
+            l_minus, l_centre, l_plus = self._operator(t)
+            self._implicit_tridiag = self._banded(-l_minus, 2.0/self._dt - l_centre, -l_plus)
+            self._exercise_factors.pop('implicit', None)
+        self._rhs[1:-1] = 2.0/self._dt*self._gridslice[1:-1]
+        self._rhs[0] = self._gridslice[0]
+        self._rhs[-1] = self._gridslice[-1]
+        self._gridslice = self._solve_step(self._implicit_tridiag, 'implicit')
+        self._applyBC()
+        return
 
-    def _beta(self, x,t):
-        sig = self._sig_func(x,t)
-        return 1.0/self._dt - self._theta*(self._r +  sig*sig/(self._dx**2))
+    def _initialise_exercise(self):
+        option = self._mkt_instrument.Option
+        self._exercise_style = 'european' if option is None else option.ExerciseStyle
+        self._exercise_low = (option is not None) and (option.PayOffType == 'put')
+        self._intrinsic = np.array(self._mkt_instrument.PayOff(self._Xj), dtype=float)
+        self._exercise_factors = {}
+        self._exercise_boundary = np.full(self._N, np.nan)
+        #steps t = i dt at the exercise times before the expiry
+        self._exercise_steps = set()
+        if self._exercise_style == 'bermudan':
+            steps = np.array([t/self._dt for t in option.ExerciseTimes if t < self._T])
+            assert np.all(np.abs(steps - np.round(steps)) <= 1e-6), f"bermudan exercise times must fall on the time steps, dt = {self._dt}, input was {option.ExerciseTimes}"
+            self._exercise_steps = {int(round(step)) for step in steps}
+
+        assert self._exercise_style in ['european', 'american', 'bermudan'], f"unknown exercise style {self._exercise_style}"
+        return
 
-    def _gamma(self, x,t):
-        mu = self._mu_func(x,t)
-        sig = self._sig_func(x,t)
-        return self._theta*(mu + sig*sig/self._dx)/(2.0*self._dx)
+    #banded solve of a time step, under the exercise constraint for an American option
+    def _solve_step(self, tridiag, key):
+        if self._exercise_style != 'american':
+            return solve_banded((1, 1), tridiag, self._rhs, check_finite=False)
+        if key not in self._exercise_factors:
+            self._exercise_factors[key] = brennan_schwartz_factors(tridiag, self._exercise_low)
+        values, nbExercised = brennan_schwartz_solve(self._exercise_factors[key], self._rhs, self._intrinsic)
+        #nodes the constraint raised, the solve counts the boundary row at the exercise end as one
+        self._exercised = np.zeros(values.shape[0], dtype=bool)
+        if self._exercise_low:
+            self._exercised[1:nbExercised] = True
+        else:
+            self._exercised[values.shape[0] - nbExercised:-1] = True
+        return values
+
+    #V = max(V, payoff) at the exercise steps, the boundary is the exercised node next to the continuation region
+    #only nodes where the payoff raised the continuation value count, the boundary rows 0 and -1 never do
+    def _apply_exercise(self, step):
+        if self._exercise_style == 'american':
+            exercised = self._exercised
+        elif step in self._exercise_steps:
+            exercised = self._gridslice < self._intrinsic
+        else:
+            return
+        np.maximum(self._gridslice, self._intrinsic, out=self._gridslice)
+        nodes = self._Xj[1:-1][exercised[1:-1]]
+        if nodes.shape[0] > 0:
+            self._exercise_boundary[step] = nodes.max() if self._exercise_low else nodes.min()
+        return
 
-    def _update_tridiag(self, t):
-        self._tridiag = np.zeros(shape = (2*self._Nj + 1,  2*self._Nj + 1))
-        self._tridiag[0,0] = self._b(self._Xj_applyConstraints(0),t)
-        self._tridiag[0,1] = self._c(self._Xj_applyConstraints(1),t)
-        self._tridiag[-1,-2] = self._a(self._Xj_applyConstraints(2*self._Nj),t)
-        self._tridiag[-1,-1] = self._b(self._Xj_applyConstraints(2*self._Nj + 1),t)
-        for j in range(1,self._tridiag.shape[0]-1):
-            x = self._Xj_applyConstraints(j)
-            self._tridiag[j, j-1] = self._a(x,t)
-            self._tridiag[j, j] = self._b(x,t)
-            self._tridiag[j, j+1] = self._c(x,t)
+    def _update_rhs(self, t):
+        if not self.TimeHomogeneous:
+            self._update_coefficients(t)
+        self._rhs[1:-1] = self._alpha[1:-1]*self._sol[:-2] \
+                            + self._beta[1:-1]*self._sol[1:-1] \
+                            + self._gamma[1:-1]*self._sol[2:]
+        self._rhs[0] = self._sol[0]
+        self._rhs[-1] = self._sol[-1]
         return
 
     def result(self):
-        return self._gridslice[self._Nj]
+        return self.results(self._spot)
+
+    #prices for any spots inside the grid, linear or cubic spline interpolation on the t = 0 slice of a single rollback
+    def results(self, spots, interpolation = 'linear'):
+        assert interpolation in ['linear', 'cubic'], f"interpolation must be 'linear' or 'cubic', input was {interpolation}"
+        assert np.all((np.asarray(spots) >= self._Xj[0]) & (np.asarray(spots) <= self._Xj[-1])), f"spots must lie inside the grid [{self._Xj[0]}, {self._Xj[-1]}], input was {spots}"
+        if interpolation == 'cubic':
+            return CubicSpline(self._Xj, self._gridslice)(spots)
+        return np.interp(spots, self._Xj, self._gridslice)
 
     def rollback(self):
-        t_from = self._N -1
+        t_from = self._N
         t_to = 0
-        np.copyto(self._sol,self._gridslice)
-        n = self._gridslice.shape[0]
+        homogeneous = self.TimeHomogeneous
         #work backwards to time starting from maturity/exercise date
         for i in range(t_from,t_to,-1):
             t = self._dt*i
+            if i > t_from - self._rannacher_steps:
+                self._implicit_half_step(t - 0.5*self._dt)
+                self._implicit_half_step(t - self._dt)
+                self._apply_exercise(i - 1)
+                continue
+            np.copyto(self._sol,self._gridslice)
             #for some time t, update the RHS to determine the  t - dt space grid
-            for j in range(0, n-1):
-                x = self._Xj_applyConstraints(j)
-                self._rhs[j] = self._alpha(x, t)*self._sol[j-1] \
-                                + self._beta(x, t)* self._sol[j] \
-                                + self._gamma(x, t)* self._sol[j+1]
-
-            self._sol =  np.linalg.solve(self._tridiag,self._rhs)
-            np.copyto(self._gridslice,self._sol)
+            self._update_rhs(t)
+
+            #implicit part of the scheme is evaluated at t - dt
+            if not homogeneous:
+                self._update_tridiag(t - self._dt)
+                self._exercise_factors.pop('theta', None)
+            self._gridslice = self._solve_step(self._tridiag, 'theta')
             self._applyBC()
-            self._update_tridiag(t)
+            self._apply_exercise(i - 1)
         return
 
 if __name__ == "__main__":
@@ -173,36 +384,37 @@ if __name__ == "__main__":
 
     prices_bs_equ = []
 
+    #one rollback per beta prices the whole curve of underlying values
+    for beta in beta_values:
+        print(f"Running for Beta: {beta}")
+
+        # build the CEV instrument, the spot only matters for the analytical price
+        CEV_Euro = CEV_Opt(spot=K,
+                          sig=sig,
+                          beta=beta,
+                          r=r,
+                          q=q,
+                          option=option
+                          )
+
+        FDM_Generic_engine = FDM_Generic_CEV(
+                        beta=(CEV_Euro.Power*2.0),
+                        mkt_instrument=CEV_Euro,
+                        r=r,
+                        N=N,
+                        Nj=Nj,
+                        theta=theta,
+                        spots=underlying_values
+                        )
+
+        FDM_Generic_engine.rollback()
+        prices_fdm[beta] = FDM_Generic_engine.results(underlying_values).tolist()
+
+        for S in underlying_values:
+            prices_analy[beta].append(CEV_Opt(spot=S, sig=sig, beta=beta, r=r, q=q, option=option).Analytical_NPV())
+
     payoff = []
     for S in underlying_values:
-        print(f"Running for Underlying value: {S}")
-
-        for beta in beta_values:
-
-            print(f"Running for Beta: {beta}")
-
-            # build the CEV instrument
-            CEV_Euro = CEV_Opt(spot=S,
-                              sig=sig,
-                              beta=beta,
-                              r=r,
-                              q=q,
-                              option=option
-                              )
-
-            FDM_Generic_engine = FDM_Generic_CEV(
-                            beta=(CEV_Euro.Power*2.0),
-                            mkt_instrument=CEV_Euro,
-                            r=r,
-                            N=N,
-                            Nj=Nj,
-                            theta=theta
-                            )
-
-            FDM_Generic_engine.rollback()
-            prices_fdm[beta].append(FDM_Generic_engine.result())
-            prices_analy[beta].append(CEV_Euro.Analytical_NPV())
-
         BS_Euro = BS(spot=S,
                      sig=sig,
                      r=r,
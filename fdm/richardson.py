@@ -0,0 +1,101 @@
+import math
+import numpy as np
+
+from qf.models.mkt_instrument_base import MktInstrument
+from fdm.fdm import FDM_Generic_CEV
+
+"""
+Richardson extrapolation of the CEV FDM price over nested grid refinements
+- level l solves on N*refinement^l time steps and Nj*refinement^l space steps, dt and dx shrink together
+- with a Rannacher start, a cell averaged payoff and cubic read off on the t = 0 slice the error of a level is
+  C h^2 + D h^4 + ..., the levels are combined in a Romberg table removing h^2, then h^4
+- the error estimate of the extrapolated price is its distance to the next lower order of the table (the
+  extrapolation of one level less), conservative as the dropped term is the larger one
+- with a single level the error estimate is inf
+
+Cost is counted in node steps, sum over the levels of time steps x nodes, the finest level dominates with
+a share of 1 - 1/refinement^2.
+"""
+class FDM_Richardson_CEV:
+    def __init__(self,
+                beta,
+                mkt_instrument: MktInstrument,
+                r,
+                N,
+                Nj,
+                levels = 2,
+                refinement = 2,
+                theta = 0.5,
+                spots = None,
+                rannacher_steps = 2,
+                **engine_kwargs
+                ):
+        self._cev_beta = beta
+        self._mkt_instrument = mkt_instrument
+        self._r = r
+        self._N = N
+        self._Nj = Nj
+        self._levels = levels
+        self._refinement = refinement
+        self._theta = theta
+        self._spots = spots
+        self._rannacher_steps = rannacher_steps
+        self._engine_kwargs = {'grid': 'sinh', 'average_payoff': True}
+        self._engine_kwargs.update(engine_kwargs)
+        self._engines = []
+
+        assert self._levels > 0, f"levels must be > 0, input was {self._levels}"
+        assert self._refinement > 1, f"refinement must be > 1, input was {self._refinement}"
+
+    #(N, Nj) of each level
+    @property
+    def Grids(self):
+        return [(self._N*self._refinement**level, self._Nj*self._refinement**level) for level in range(self._levels)]
+
+    #time steps x nodes summed over the levels rolled back
+    @property
+    def Cost(self):
+        return sum(engine._N*engine.Nodes.shape[0] for engine in self._engines)
+
+    @property
+    def ErrorEstimate(self):
+        return self.error_estimates(self._mkt_instrument.Spot)
+
+    def rollback(self):
+        self._engines = []
+        for N, Nj in self.Grids:
+            engine = FDM_Generic_CEV(beta=self._cev_beta, mkt_instrument=self._mkt_instrument, r=self._r, N=N, Nj=Nj,
+                                     theta=self._theta, spots=self._spots, rannacher_steps=min(self._rannacher_steps, N),
+                                     **self._engine_kwargs)
+            engine.rollback()
+            self._engines.append(engine)
+        return
+
+    """Romberg table of the level prices at the spots, row l holds level l extrapolated k = 0..l times
+    """
+    def _table(self, spots):
+        assert len(self._engines) > 0, "rollback before reading results"
+        table = []
+        for level, engine in enumerate(self._engines):
+            row = [np.asarray(engine.results(spots, interpolation='cubic'), dtype=float)]
+            for k in range(1, level + 1):
+                factor = self._refinement**(2*k) - 1.0
+                row.append(row[k - 1] + (row[k - 1] - table[level - 1][k - 1])/factor)
+            table.append(row)
+        return table
+
+    def result(self):
+        return self.results(self._mkt_instrument.Spot)
+
+    def results(self, spots):
+        return self._table(spots)[-1][-1]
+
+    #prices of every level at the spots, before extrapolation, one row per level
+    def level_results(self, spots):
+        return np.array([row[0] for row in self._table(spots)])
+
+    def error_estimates(self, spots):
+        last = self._table(spots)[-1]
+        if len(last) < 2:
+            return np.full(np.shape(spots), math.inf)
+        return np.abs(last[-1] - last[-2])
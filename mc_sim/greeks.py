@@ -0,0 +1,41 @@
+import numpy as np
+
+from sde.process_base import SDEProcess
+from qf.models.mkt_instrument_base import MktInstrument
+
+"""
+Greeks on the paths of the price, one pass steps the price paths together with their tangent paths
+(SDEProcess.Xt_paths_tangent) on the same normals
+- delta, vega and beta (sensitivity to beta = 2*power, processes with a power only) are pathwise,
+      dNPV/dtheta = f'(X_T) dX_T/dtheta
+  with f' the payoff derivative (an indicator for calls and puts) and dX_T/dtheta the tangent path, unbiased for
+  Lipschitz payoffs with bounded variance
+- gamma is not pathwise (f'' is a point mass at the strike), it uses the likelihood ratio (Bismut-Elworthy-Li) weight
+      delta = E[f(X_T) w],  w = 1/T sum_n Y_n dW_n / b(X_n)
+  with Y = dX/dX0 the tangent path, and differentiates once more, gamma = E[f'(X_T) Y_T w + f(X_T) dw/dX0]
+- the process has to be stepped with a scheme, exact samplers (GBM, CEVExact) have no tangent paths
+- rng is the normals source of the block, SimMapping.evaluate_greeks_block hands over the one of evaluate_block
+
+bump is relative to the path value, it only sets the difference of the scheme tangent giving the second spot tangent
+"""
+GREEKS = ['delta', 'gamma', 'vega', 'beta']
+
+def greeks_block(underlying_process: SDEProcess, mkt_instrument: MktInstrument, nbPaths: int, rng = None, bump = 1e-4):
+    assert underlying_process.Stepped, f"pathwise greeks need a process stepped with a scheme, {type(underlying_process).__name__} is not"
+    times,values,tangents,weight,weight_spot = underlying_process.Xt_paths_tangent(mkt_instrument.Spot, mkt_instrument.CashflowTimes,
+                                                                                   nbPaths, rng, bump)
+    npv = mkt_instrument.NPV(times,values).reshape(nbPaths)
+    npv_deriv = mkt_instrument.NPV_Deriv(times,values)
+
+    def pathwise(tangent):
+        return np.sum(npv_deriv*tangent, axis=1)
+
+    npv_delta = pathwise(tangents['spot'])
+    greeks = {'npv': npv,
+              'delta': npv_delta,
+              'gamma': npv_delta*weight + npv*weight_spot,
+              'vega': pathwise(tangents['vol'])}
+
+    if 'power' in tangents:
+        greeks['beta'] = 0.5*pathwise(tangents['power'])
+    return greeks
@@ -0,0 +1,144 @@
+import math
+
+import numpy as np
+
+from mc_sim.simulation import SimulationConfig, SimMapping, SimStats
+
+"""Multilevel Monte Carlo (Giles, M. B. (2008), 'Multilevel Monte Carlo Path Simulation', Operations Research 56,
+607-617) for processes stepped with a scheme
+
+Level l steps baseSteps*refinement^l times to the expiry, the estimate is
+    E[P_L] = E[P_0] + sum_l E[P_l - P_l-1]
+with the corrections simulated on coupled fine/coarse paths (SimMapping.evaluate_level), their variance falls with
+the level so most paths are spent on the cheap coarse levels.
+
+- Goal of the SimulationConfig is the target root mean square error, half of its square is given to the variance and
+  half to the squared bias
+- the level variances are estimated on the fly, paths are allocated as N_l ~ sqrt(V_l/C_l), C_l the steps per path
+- levels are added until the bias estimate, the last corrections divided by refinement - 1 (weak order 1), meets
+  the goal or the finest level has index maxLevel, level indices run 0..maxLevel so a run uses at most maxLevel + 1
+  levels (3 to start with)
+- NumberSimus caps the total number of paths, BlockSize the paths simulated per call
+"""
+class MLMCSimulation:
+    def __init__(self, simconfig: SimulationConfig, simmapping: SimMapping, baseSteps: int = 4, refinement: int = 2,
+                 maxLevel: int = 10, initialSims: int = 1000, debug = False):
+        self._simconfig = simconfig
+        self._simMapping = simmapping
+        self._baseSteps = baseSteps
+        self._refinement = refinement
+        self._maxLevel = maxLevel
+        self._initialSims = initialSims
+        self._debug = debug
+        self._levelstats = []
+        self._levelseeds = []
+
+        assert self._baseSteps > 0, f"baseSteps must be > 0, input was {self._baseSteps}"
+        assert self._refinement > 1, f"refinement must be > 1, input was {self._refinement}"
+        assert self._maxLevel >= 2, f"maxLevel must be >= 2, the run starts with levels 0, 1, 2, input was {self._maxLevel}"
+        assert self._initialSims > 1, f"initialSims must be > 1, input was {self._initialSims}"
+
+    @property
+    def NbLevels(self):
+        return len(self._levelstats)
+
+    @property
+    def SimsDone(self):
+        return sum(stats.SimsDone for stats in self._levelstats)
+
+    @property
+    def SimMean(self):
+        return sum(stats.SimMean for stats in self._levelstats)
+
+    #variance of the estimator, sum of V_l/N_l
+    @property
+    def EstimatorVariance(self):
+        return sum(stats.SimVariance/float(stats.SimsDone) for stats in self._levelstats)
+
+    @property
+    def BiasEstimate(self):
+        if self.NbLevels < 2:
+            return math.inf
+        last = abs(self._levelstats[-1].SimMean)
+        previous = abs(self._levelstats[-2].SimMean)/self._refinement if self.NbLevels > 2 else last
+        return max(last, previous)/(self._refinement - 1.0)
+
+    @property
+    def RMSE(self):
+        return math.sqrt(self.EstimatorVariance + self.BiasEstimate**2.0)
+
+    """Per level statistics, one row per level: steps, paths, mean and variance of the correction, cost per path
+    """
+    @property
+    def LevelStats(self):
+        return np.array([[self._level_steps(level), stats.SimsDone, stats.SimMean, stats.SimVariance, self._level_cost(level)]
+                         for level, stats in enumerate(self._levelstats)])
+
+    @property
+    def SimSnapshot(self):
+        return np.array([self.SimsDone, self.SimMean, self.RMSE])
+
+    def _level_steps(self, level: int):
+        return self._baseSteps*(self._refinement**level)
+
+    #steps per path, the coupled coarse path included
+    def _level_cost(self, level: int):
+        steps = float(self._level_steps(level))
+        return steps if level == 0 else steps*(1.0 + 1.0/self._refinement)
+
+    def _add_level(self):
+        level = self.NbLevels
+        self._levelstats.append(SimStats(CI=self._simconfig.ConfidenceLevel, snapshotsims=self._simconfig.SnapshotSims, goal=self._simconfig.Goal))
+        self._levelseeds.append(np.random.default_rng(np.random.SeedSequence(self._simconfig.Seed).spawn(level + 1)[level]))
+
+    def _simulate_level(self, level: int, nbPaths: int):
+        blocksize = self._simconfig.BlockSize if self._simconfig.BlockSize is not None else nbPaths
+        refinement = None if level == 0 else self._refinement
+        for simidx in range(0, nbPaths, blocksize):
+            nbBlock = min(blocksize, nbPaths - simidx)
+            self._levelstats[level].StoreBlock(self._simMapping.evaluate_level(nbBlock, self._level_steps(level),
+                                                                               refinement, self._levelseeds[level]))
+
+    #paths per level for a variance of goal^2/2
+    def _optimal_sims(self):
+        variances = np.array([stats.SimVariance for stats in self._levelstats])
+        costs = np.array([self._level_cost(level) for level in range(0, self.NbLevels)])
+        goal = self._simconfig.Goal
+        return np.ceil(2.0/(goal*goal)*np.sqrt(variances/costs)*np.sum(np.sqrt(variances*costs))).astype(int)
+
+    def _print_levels(self):
+        print("{:<8} {:<8} {:<12} {:<14} {:<14}".format('Level', 'Steps', 'Paths', 'Mean', 'Variance'))
+        for level, row in enumerate(self.LevelStats):
+            print(f"{level:<8d} {int(row[0]):<8d} {int(row[1]):<12d} {row[2]:<14.6f} {row[3]:<14.6e}")
+
+    def run(self):
+        goal = self._simconfig.Goal
+        for level in range(0, 3):
+            self._add_level()
+            self._simulate_level(level, self._initialSims)
+
+        converged = False
+        while self.SimsDone < self._simconfig.NumberSimus:
+            extra = np.maximum(self._optimal_sims() - np.array([stats.SimsDone for stats in self._levelstats]), 0)
+            budget = self._simconfig.NumberSimus - self.SimsDone
+            if np.sum(extra) > budget:
+                extra = np.floor(extra*budget/float(np.sum(extra))).astype(int)
+            for level in range(0, self.NbLevels):
+                if extra[level] > 0:
+                    self._simulate_level(level, int(extra[level]))
+
+            if np.any(extra > 0.01*np.array([stats.SimsDone for stats in self._levelstats])):
+                continue
+            if self.BiasEstimate <= goal/math.sqrt(2.0):
+                converged = True
+                break
+            #finest level index is NbLevels - 1
+            if self.NbLevels - 1 >= self._maxLevel:
+                break
+            self._add_level()
+            self._simulate_level(self.NbLevels - 1, self._initialSims)
+
+        if self._debug:
+            self._print_levels()
+
+        return converged, self.SimSnapshot
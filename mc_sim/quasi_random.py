@@ -0,0 +1,48 @@
+import math
+
+import numpy as np
+from scipy.stats import norm, qmc
+
+"""Brownian bridge on a uniform grid
+Z holds iid standard normals, one row per path. Column 0 sets the end point, the following columns fill in the
+midpoints level by level, so the first (best distributed) quasi-random dimensions carry most of the path variance.
+Returns the increments scaled to unit variance, again iid standard normals, in time order.
+"""
+def brownian_bridge(Z: np.ndarray):
+    nbPaths, nbSteps = Z.shape
+    W = np.zeros((nbPaths, nbSteps + 1))
+    W[:, nbSteps] = math.sqrt(nbSteps)*Z[:, 0]
+    intervals = [(0, nbSteps)]
+    dim = 1
+    while intervals:
+        left, right = intervals.pop(0)
+        if right - left < 2:
+            continue
+        mid = (left + right)//2
+        weight = (mid - left)/float(right - left)
+        std = math.sqrt((mid - left)*(right - mid)/float(right - left))
+        W[:, mid] = W[:, left] + weight*(W[:, right] - W[:, left]) + std*Z[:, dim]
+        dim += 1
+        intervals.append((left, mid))
+        intervals.append((mid, right))
+    return np.diff(W, axis=1)
+
+"""Scrambled Sobol normals, a drop in for the generator of the processes (standard_normal only)
+- one Sobol sequence per dimension count, successive draws continue it
+- rng seeds the scrambling, None uses fresh entropy, each seed gives an independent randomised QMC replication
+- the number of paths per draw should be a power of 2 to keep the balance properties of the sequence
+- bridge: build the columns of a (paths, steps) draw with a Brownian bridge
+"""
+class SobolNormals:
+    def __init__(self, rng = None, bridge = True):
+        self._rng = rng
+        self._bridge = bridge
+        self._engines = {}
+
+    def standard_normal(self, size):
+        nbPoints, nbDims = size
+        if nbDims not in self._engines:
+            self._engines[nbDims] = qmc.Sobol(nbDims, scramble=True, seed=self._rng)
+        U = self._engines[nbDims].random(nbPoints)
+        Z = norm.ppf(U)
+        return brownian_bridge(Z) if self._bridge else Z
@@ -1,9 +1,20 @@
+import itertools
 import math
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+
 import numpy as np
 from scipy.stats import norm
 
 from sde.process_base import SDEProcess
 from qf.models.mkt_instrument_base import MktInstrument
+from mc_sim.variance_reduction import RecordedNormals, ControlVariate
+from mc_sim.quasi_random import SobolNormals
+from mc_sim.greeks import greeks_block
+
+#block streams spawned from the SeedSequence at a time
+SEED_CHUNK = 1024
 
 class SimulationConfig:
 
@@ -23,46 +34,137 @@ class SimulationConfig:
     def Goal(self):
         return self._goal
 
-    def __init__(self, numberSimus, CI = 0.95, snapshotsims = 1000, goal = 0.05):
+    @property
+    def BlockSize(self):
+        return self._blocksize
+
+    @property
+    def CheckSims(self):
+        return self._checksims
+
+    @property
+    def Workers(self):
+        return self._workers
+
+    @property
+    def Threads(self):
+        return self._threads
+
+    @property
+    def Seed(self):
+        return self._seed
+
+    """blocksize: number of paths simulated together per call to the process, None simulates one path at a time
+       checksims: number of simulations between checks of the accuracy goal
+       workers: number of worker processes, None runs in the calling process
+       threads: number of threads simulating blocks in the calling process, blocks should be large enough
+                (>= 10^4 paths) for numpy to spend most of its time outside the GIL
+       seed: seed of the SeedSequence the per block generators are spawned from, None uses fresh entropy
+             (or the global np.random state for a serial run)
+    """
+    def __init__(self, numberSimus, CI = 0.95, snapshotsims = 1000, goal = 0.05, blocksize = None, checksims = 1,
+                 workers = None, threads = None, seed = None):
         self._numberSimus = numberSimus
         self._CI = CI
         self._snapshotsims = snapshotsims
         self._goal = goal
+        self._blocksize = blocksize
+        self._checksims = checksims
+        self._workers = workers
+        self._threads = threads
+        self._seed = seed
+
+        assert (self._blocksize is None) or (self._blocksize > 0), f"blocksize must be > 0, input was {self._blocksize}"
+        assert self._checksims > 0, f"checksims must be > 0, input was {self._checksims}"
+        assert (self._workers is None) or (self._workers > 0), f"workers must be > 0, input was {self._workers}"
+        assert (self._threads is None) or (self._threads > 0), f"threads must be > 0, input was {self._threads}"
+        assert (self._workers is None) or (self._threads is None), "choose either worker processes or threads"
+        assert ((self._workers is None) and (self._threads is None)) or (self._blocksize is not None), "parallel runs need a blocksize"
 
 
-"""To do:
+"""Streaming simulation statistics
+- keeps the running count, mean and sum of squared deviations (Welford), memory does not grow with the number of simulations
+- blocks of results and SimStats from other workers are combined with the parallel merge formula of Chan et al.
+- a result can be a vector (one entry per instrument of a portfolio), the statistics are kept per entry and the
+  accuracy goal has to be reached by every entry
+- the arguments are keyword only
+To do:
    - Fix the debug printing statements. Constant tab-width table view.     
 """
 class SimStats:
-    def __init__(self, numbersimus: int, CI: float, snapshotsims: int, goal: float, debug = False):
-        self._results = np.zeros(numbersimus)
+    def __init__(self, *, CI: float, snapshotsims: int, goal: float, debug = False):
         self._simsDone = 0
+        self._mean = 0.0
+        self._m2 = 0.0
         self._CI = CI
-        self._CI_width = 0
         self._snapshotsims = snapshotsims
-        self._snapshotStats = np.array([])
         self._goal= goal
         self._debug = debug
 
         assert (self._CI > 0.0) & (self._CI < 1.0),  f"CI must be > 0 and < 1, input was {self._CI}"
 
+        self._z = norm.ppf(self._CI)
+
         if self._debug:
             print(f"Running simulation")
             print("{:<20} {:<20} {:<10}".format('Simulation Number  |', 'Simulation Output  |','CI width |'))
 
-    def Store(self, sim: int, res: float):
-        self._results[sim] = res
-        self._simsDone = sim+1
+    def Store(self, res: float):
+        self._simsDone += 1
+        delta = res - self._mean
+        self._mean += delta/self._simsDone
+        self._m2 += delta*(res - self._mean)
 
         if self._debug:
             if self._simsDone%self._snapshotsims == 0:
-                    print(f"{int(self.SimSnapshot[0]):15d} {self.SimSnapshot[1]:20.2f} {self.SimSnapshot[2]:12.4f}")
+                    self._print_snapshot()
+        return
+
+    def StoreBlock(self, res: np.ndarray):
+        nbRes = res.shape[0]
+        if nbRes == 0:
+            return
+        block_mean = np.mean(res, axis=0)
+        block_dev = res - block_mean
+        self._merge_moments(nbRes, block_mean, np.sum(block_dev*block_dev, axis=0))
+        return
+
+    #combine the statistics of another (independent) run into this one
+    def Merge(self, other: 'SimStats'):
+        if other.SimsDone == 0:
+            return
+        self._merge_moments(other.SimsDone, other._mean, other._m2)
+        return
+
+    def _merge_moments(self, count: int, mean: float, m2: float):
+        sims_before = self._simsDone
+        total = sims_before + count
+        delta = mean - self._mean
+        self._mean += delta*count/float(total)
+        self._m2 += m2 + delta*delta*sims_before*count/float(total)
+        self._simsDone = total
+
+        if self._debug:
+            if (self._simsDone//self._snapshotsims) > (sims_before//self._snapshotsims):
+                    self._print_snapshot()
         return
 
+    def _print_snapshot(self):
+        if np.ndim(self._mean) > 0:
+            print(f"{self._simsDone:15d} {np.array2string(self.SimMean, precision=2)} {np.array2string(self.CI_width, precision=4)}")
+            return
+        print(f"{int(self.SimSnapshot[0]):15d} {self.SimSnapshot[1]:20.2f} {self.SimSnapshot[2]:12.4f}")
+
+    @property
+    def SimsDone(self):
+        return self._simsDone
+
     @property
     def AccuracyReached(self):
-        if self.CI_width > 0:
-            if self.CI_width < self._goal:
+        if self._simsDone < 2:
+            return False
+        if np.all(self.CI_width > 0):
+            if np.all(self.CI_width < self._goal):
                 return True
             else:
                 return False
@@ -71,36 +173,227 @@ class SimStats:
 
     @property
     def SimSnapshot(self):
-        #store the number of simulations, most recent est, standard error range
-        return np.array([self._simsDone, self.SimMean, self.CI_width])
+        #store the number of simulations, most recent est, standard error range, one column per entry for vector results
+        return np.array(np.broadcast_arrays(self._simsDone, self.SimMean, self.CI_width), dtype=float)
 
-    #To do: Add an Assert on 0 sims
     @property
     def SimMean(self):
-        return np.sum(self._results)/float(self._simsDone)
+        assert self._simsDone > 0, "No simulations stored"
+        return self._mean
 
-    #To do: Add an Assert on 0 sims
     @property
     def SimVariance(self):
-        return np.dot(self._results,self._results)/float(self._simsDone) - self.SimMean**2
+        assert self._simsDone > 0, "No simulations stored"
+        return self._m2/float(self._simsDone)
 
     @property
     def CI_width(self):
-        return 2*norm.ppf(self._CI)*math.sqrt(self.SimVariance/float(self._simsDone))
+        return 2*self._z*np.sqrt(self.SimVariance/float(self._simsDone))
 
 """ To do:
-    - add a wrapper class for a portfolio of instruments 
     - add in numeraire process for real world 
     - extend for multiple underlyings
+
+Variance reduction (block evaluation only, the process must draw its Brownian increments with rng.standard_normal)
+- antithetic: nbPaths/2 pairs (Z, -Z), each pair average is one sample so the statistics count pairs
+- control_variate: a ControlVariate (see mc_sim.variance_reduction) driven by the same draws, the samples are
+  Y - b(C - E[C]) with b = Cov(Y, C)/Var(C) estimated on each block
+- moment_matching: normals standardised per time step within the block, the samples of a block are no longer
+  independent and the CI is conservative
+VarianceReductionFactor is the variance per path of the plain payoffs over the variance per path of the samples
+(a pair counts as two paths), moment matching is not seen by it. The moments of each block are returned with the
+block by evaluate_block_stats and merged into the mapping by the Simulation, in the calling process whatever the
+run mode, and reset when a run starts
+
+qmc: the normals come from scrambled Sobol sequences with a Brownian bridge (see mc_sim.quasi_random), each block
+is one randomised QMC replication scrambled from the block generator and its mean is one sample, so the statistics
+count replications. Blocksizes should be powers of 2. Combines with the variance reduction options.
 """
 class SimMapping:
-    def __init__(self, underlying_process: SDEProcess, mkt_instrument: MktInstrument):
+    def __init__(self, underlying_process: SDEProcess, mkt_instrument: MktInstrument, antithetic = False,
+                 control_variate: ControlVariate = None, moment_matching = False, qmc = False):
         self._mkt_instrument = mkt_instrument
         self._underlying_process = underlying_process
+        self._antithetic = antithetic
+        self._control_variate = control_variate
+        self._moment_matching = moment_matching
+        self._qmc = qmc
+        self.reset_stats()
+
+    @property
+    def Process(self):
+        return self._underlying_process
+
+    @property
+    def Instrument(self):
+        return self._mkt_instrument
+
+    @property
+    def VarianceReduction(self):
+        return self._antithetic or self._moment_matching or (self._control_variate is not None)
+
+    @property
+    def VarianceReductionFactor(self):
+        paths_per_sample = 2.0 if self._antithetic else 1.0
+        return self._plain_stats.SimVariance/(self._reduced_stats.SimVariance*paths_per_sample)
+
+    #plain and variance reduced moments of the runs since the last reset
+    def reset_stats(self):
+        self._plain_stats = SimStats(CI=0.95, snapshotsims=1, goal=0.0)
+        self._reduced_stats = SimStats(CI=0.95, snapshotsims=1, goal=0.0)
+        return
+
+    #block moments returned by evaluate_block_stats, None without variance reduction
+    def merge_stats(self, block_stats):
+        if block_stats is None:
+            return
+        plain, reduced = block_stats
+        self._plain_stats.Merge(plain)
+        self._reduced_stats.Merge(reduced)
+        return
 
     def evaluate(self):
+        assert not (self.VarianceReduction or self._qmc), "variance reduction and qmc need a blocksize"
         cashflow_times,underlying_values = self._underlying_process.Xt(self._mkt_instrument.Spot ,self._mkt_instrument.CashflowTimes)
-        return self._mkt_instrument.NPV(cashflow_times,underlying_values)
+        return self._mkt_instrument.NPV(cashflow_times,underlying_values).item()
+
+    def evaluate_block(self, nbPaths: int, rng = None):
+        return self.evaluate_block_stats(nbPaths, rng)[0]
+
+    """Block result and the (plain, reduced) SimStats of the block, None without variance reduction
+    - the mapping itself is not updated, the caller merges the moments with merge_stats
+    """
+    def evaluate_block_stats(self, nbPaths: int, rng = None):
+        normals = self._block_normals(rng)
+        nbDrawn = self._nb_drawn(nbPaths)
+        cashflow_times,underlying_values = self._underlying_process.Xt_paths(self._mkt_instrument.Spot ,self._mkt_instrument.CashflowTimes, nbDrawn, normals)
+        plain = self._mkt_instrument.NPV(cashflow_times,underlying_values).reshape(nbDrawn)
+        samples = self._paired(self._controlled(plain, normals))
+
+        block_stats = None
+        if self.VarianceReduction:
+            plain_stats = SimStats(CI=0.95, snapshotsims=1, goal=0.0)
+            plain_stats.StoreBlock(plain)
+            reduced_stats = SimStats(CI=0.95, snapshotsims=1, goal=0.0)
+            reduced_stats.StoreBlock(samples)
+            block_stats = (plain_stats, reduced_stats)
+
+        if self._qmc:
+            return np.array([np.mean(samples)]), block_stats
+        return samples, block_stats
+
+    """Stream of block results, one evaluate_block per entry of block_sizes with the matching generator of rngs
+    - blocks are simulated when requested, the consumer stops the stream by not asking for more
+    - with_stats yields the (result, block moments) pairs of evaluate_block_stats
+    """
+    def iter_blocks(self, block_sizes, rngs = None, with_stats = False):
+        rngs = itertools.repeat(None) if rngs is None else rngs
+        for nbPaths, rng in zip(block_sizes, rngs):
+            block = self.evaluate_block_stats(nbPaths, rng)
+            yield block if with_stats else block[0]
+
+    """Price and greeks per sample on the same draws, see mc_sim.greeks
+    - the normals come from the source of evaluate_block, the samples are paired, averaged per QMC replication and
+      the price is controlled in the same way, the greeks are not controlled (the control has no known greeks)
+    """
+    def evaluate_greeks_block(self, nbPaths: int, rng = None):
+        normals = self._block_normals(rng)
+        block = greeks_block(self._underlying_process, self._mkt_instrument, self._nb_drawn(nbPaths), normals)
+        block['npv'] = self._controlled(block['npv'], normals)
+        block = {name: self._paired(values) for name, values in block.items()}
+        if self._qmc:
+            return {name: np.array([np.mean(values)]) for name, values in block.items()}
+        return block
+
+    """Multilevel correction, payoff on nbSteps step paths minus payoff on the coupled nbSteps/refinement step paths
+    - refinement None is the coarsest level, the plain payoff on nbSteps step paths
+    """
+    def evaluate_level(self, nbPaths: int, nbSteps: int, refinement: int = None, rng = None):
+        spot = self._mkt_instrument.Spot
+        cashflow_times = self._mkt_instrument.CashflowTimes
+        if refinement is None:
+            fine_times,fine_values = self._underlying_process.Xt_paths_steps(spot, cashflow_times, nbPaths, nbSteps, rng)
+            return self._mkt_instrument.NPV(fine_times,fine_values).reshape(nbPaths)
+
+        (fine_times,fine_values),(coarse_times,coarse_values) = \
+            self._underlying_process.Xt_paths_coupled(spot, cashflow_times, nbPaths, nbSteps, refinement, rng)
+        return self._mkt_instrument.NPV(fine_times,fine_values).reshape(nbPaths) \
+               - self._mkt_instrument.NPV(coarse_times,coarse_values).reshape(nbPaths)
+
+    #normals source of a block, Sobol points for qmc, recorded (antithetic, moment matched) draws for variance reduction
+    def _block_normals(self, rng):
+        if self._qmc:
+            rng = SobolNormals(rng)
+        if self.VarianceReduction:
+            return RecordedNormals(rng, self._antithetic, self._moment_matching)
+        return rng
+
+    #paths drawn for nbPaths, antithetic pairs need an even number
+    def _nb_drawn(self, nbPaths: int):
+        return nbPaths + nbPaths%2 if self._antithetic else nbPaths
+
+    #Y - b(C - E[C]) with the control priced on the replayed normals, b estimated on the block
+    def _controlled(self, plain: np.ndarray, normals):
+        if self._control_variate is None:
+            return plain
+        control = self._control_variate.evaluate_block(plain.shape[0], normals.replay())
+        control_dev = control - np.mean(control)
+        control_var = np.dot(control_dev, control_dev)
+        b = np.dot(plain - np.mean(plain), control_dev)/control_var if control_var > 0.0 else 0.0
+        return plain - b*(control - self._control_variate.Mean)
+
+    #average of the antithetic pairs, path i is paired with path i + nbDrawn/2
+    def _paired(self, samples: np.ndarray):
+        if not self._antithetic:
+            return samples
+        nbDrawn = samples.shape[0]
+        return 0.5*(samples[:nbDrawn//2] + samples[nbDrawn//2:])
+
+"""Portfolio of instruments priced on shared scenarios
+- mappings sharing a process object and spot are simulated once per block, on the union of their cashflow times
+- the processes simulate one path over the union of the cashflow times, each instrument picks its own times
+- the portfolio has no process or instrument of its own and no variance reduction
+- a result has one entry per position (quantity*NPV) and the aggregate in the last entry, SimStats keeps the
+  statistics of each entry
+"""
+class PortfolioMapping(SimMapping):
+    def __init__(self, mappings: list, quantities = None):
+        SimMapping.__init__(self, underlying_process=None, mkt_instrument=None)
+        self._mappings = mappings
+        self._quantities = np.ones(len(mappings)) if quantities is None else np.asarray(quantities, dtype=float)
+
+        assert len(self._mappings) > 0, "empty portfolio"
+        assert self._quantities.shape == (len(self._mappings),), f"one quantity per mapping, input was {self._quantities.shape}"
+
+        #positions grouped by (process, spot), each group is simulated once
+        self._groups = {}
+        for posidx, mapping in enumerate(self._mappings):
+            key = (id(mapping.Process), mapping.Instrument.Spot)
+            self._groups.setdefault(key, []).append(posidx)
+        self._group_times = {key: np.unique(np.concatenate([self._mappings[posidx].Instrument.CashflowTimes for posidx in positions]))
+                             for key, positions in self._groups.items()}
+
+    @property
+    def NbPositions(self):
+        return len(self._mappings)
+
+    @property
+    def NbSimulatedProcesses(self):
+        return len(self._groups)
+
+    def evaluate(self):
+        return self.evaluate_block(1)[0]
+
+    def evaluate_block_stats(self, nbPaths: int, rng = None):
+        res = np.zeros((nbPaths, self.NbPositions + 1), order='F')
+        for key, positions in self._groups.items():
+            process = self._mappings[positions[0]].Process
+            sim_times,values = process.Xt_paths(key[1], self._group_times[key], nbPaths, rng)
+            for posidx in positions:
+                instrument = self._mappings[posidx].Instrument
+                res[:, posidx] = self._quantities[posidx]*instrument.NPV(sim_times,values).reshape(nbPaths)
+        res[:, -1] = np.sum(res[:, :-1], axis=1)
+        return res, None
 
 #Monte Carlo Simulation class
 """
@@ -120,18 +413,161 @@ class Simulation:
     def SimuConfig(self):
         return self._simuConfig
 
-    def __init__(self, simconfig: SimulationConfig, simmapping: SimMapping, debug = False):
+    """Snapshots (number of simulations, estimate, CI width) of the greeks, empty unless the run computed them
+    """
+    @property
+    def Greeks(self):
+        return {name: stats.SimSnapshot for name, stats in self._greekstats.items()}
+
+    """greeks: estimate delta, gamma, vega and beta with the price in the same pass (blocks in the calling process
+               only), each greek has its own SimStats, the accuracy goal applies to the price
+    """
+    def __init__(self, simconfig: SimulationConfig, simmapping: SimMapping, debug = False, greeks = False):
         self._simconfig = simconfig
-        self._simstats = SimStats(self._simconfig.NumberSimus, self._simconfig.ConfidenceLevel, self._simconfig.SnapshotSims, self._simconfig.Goal, debug)
+        self._simstats = SimStats(CI=self._simconfig.ConfidenceLevel, snapshotsims=self._simconfig.SnapshotSims, goal=self._simconfig.Goal, debug=debug)
         self._simMapping = simmapping
         self._nbSimus = self._simconfig.NumberSimus
+        self._greeks = greeks
+        self._greekstats = {}
+
+        assert not self._greeks or ((self._simconfig.BlockSize is not None) and (self._simconfig.Workers is None)
+                                    and (self._simconfig.Threads is None)), "greeks need a blocksize and a serial run"
+
+    #the accuracy goal is only tested once every CheckSims simulations
+    def _check_accuracy(self, sims_before: int):
+        checksims = self._simconfig.CheckSims
+        if (self._simstats.SimsDone//checksims) > (sims_before//checksims):
+            return self._simstats.AccuracyReached
+        return False
 
     def run(self):
+        self._simMapping.reset_stats()
+        if self._greeks:
+            return self._run_greeks()
+        if self._simconfig.Workers is not None:
+            return self._run_parallel()
+        if self._simconfig.Threads is not None:
+            return self._run_threads()
+        if self._simconfig.BlockSize is not None:
+            return self._run_blocks()
+
         for simidx in range(0, self._nbSimus):
             simOutput = self._simMapping.evaluate()
-            self._simstats.Store(simidx, simOutput)
-            if self._simstats.AccuracyReached:
+            self._simstats.Store(simOutput)
+            if self._check_accuracy(simidx):
+                break
+
+        return self._simstats.AccuracyReached, self._simstats.SimSnapshot
+
+    #paths in each block, the last block takes the remainder, generated as the blocks are started
+    def _block_sizes(self):
+        blocksize = self._simconfig.BlockSize
+        for simidx in range(0, self._nbSimus, blocksize):
+            yield min(blocksize, self._nbSimus - simidx)
+
+    """One independent stream per block, open ended, blocks are reproducible for a given seed and blocksize
+    - the children are spawned SEED_CHUNK at a time, successive spawns continue the sequence so block i gets the
+      same stream as from a single spawn
+    """
+    def _block_seeds(self):
+        seed_sequence = np.random.SeedSequence(self._simconfig.Seed)
+        while True:
+            yield from seed_sequence.spawn(SEED_CHUNK)
+
+    """Simulate BlockSize paths per call
+    - the blocks are streamed from the mapping, reduced into the statistics and dropped, memory is set by the
+      blocksize whatever the number of simulations
+    """
+    def _run_blocks(self):
+        rngs = (np.random.default_rng(seed) for seed in self._block_seeds()) if self._simconfig.Seed is not None else None
+        for simOutput, block_stats in self._simMapping.iter_blocks(self._block_sizes(), rngs, with_stats=True):
+            sims_before = self._simstats.SimsDone
+            self._simstats.StoreBlock(simOutput)
+            self._simMapping.merge_stats(block_stats)
+            if self._check_accuracy(sims_before):
+                break
+
+        return self._simstats.AccuracyReached, self._simstats.SimSnapshot
+
+    def _run_greeks(self):
+        seeds = self._block_seeds() if self._simconfig.Seed is not None else itertools.repeat(None)
+        for nbPaths, seed in zip(self._block_sizes(), seeds):
+            rng = np.random.default_rng(seed) if seed is not None else None
+            sims_before = self._simstats.SimsDone
+            block = self._simMapping.evaluate_greeks_block(nbPaths, rng)
+            self._simstats.StoreBlock(block.pop('npv'))
+            for name, values in block.items():
+                if name not in self._greekstats:
+                    self._greekstats[name] = SimStats(CI=self._simconfig.ConfidenceLevel, snapshotsims=self._simconfig.SnapshotSims, goal=self._simconfig.Goal)
+                self._greekstats[name].StoreBlock(values)
+            if self._check_accuracy(sims_before):
                 break
 
         return self._simstats.AccuracyReached, self._simstats.SimSnapshot
 
+    """Blocks are simulated in a pool of worker processes
+    - at most 2 blocks per worker are in flight, results are merged in block order so the run is reproducible
+    - blocks still queued when the accuracy goal is reached are cancelled
+    """
+    def _run_parallel(self):
+        workers = self._simconfig.Workers
+        blocks = zip(self._block_sizes(), self._block_seeds())
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for nbPaths, seed in itertools.islice(blocks, 2*workers):
+                pending.append(executor.submit(_simulate_block, self._simMapping, nbPaths, seed, self._simconfig))
+            while pending:
+                sims_before = self._simstats.SimsDone
+                stats, block_stats = pending.popleft().result()
+                self._simstats.Merge(stats)
+                self._simMapping.merge_stats(block_stats)
+                if self._check_accuracy(sims_before):
+                    for future in pending:
+                        future.cancel()
+                    break
+                #one block out, one block in
+                for nbPaths, seed in itertools.islice(blocks, 1):
+                    pending.append(executor.submit(_simulate_block, self._simMapping, nbPaths, seed, self._simconfig))
+
+        return self._simstats.AccuracyReached, self._simstats.SimSnapshot
+
+    """Blocks are simulated on a pool of threads sharing this process
+    - each thread draws from its own Generator, spawned from the SeedSequence
+    - the statistics are shared, updates and the accuracy check are done under a lock
+    - which thread simulates which block depends on scheduling, runs are not bit for bit reproducible
+    """
+    def _run_threads(self):
+        threads = self._simconfig.Threads
+        block_sizes = self._block_sizes()
+        lock = Lock()
+        state = {'stop': False}
+
+        def simulate_blocks(seed):
+            rng = np.random.default_rng(seed)
+            while True:
+                with lock:
+                    nbPaths = None if state['stop'] else next(block_sizes, None)
+                    if nbPaths is None:
+                        return
+
+                simOutput, block_stats = self._simMapping.evaluate_block_stats(nbPaths, rng)
+
+                with lock:
+                    sims_before = self._simstats.SimsDone
+                    self._simstats.StoreBlock(simOutput)
+                    self._simMapping.merge_stats(block_stats)
+                    if self._check_accuracy(sims_before):
+                        state['stop'] = True
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for future in [executor.submit(simulate_blocks, seed) for seed in itertools.islice(self._block_seeds(), threads)]:
+                future.result()
+
+        return self._simstats.AccuracyReached, self._simstats.SimSnapshot
+
+#worker process task, statistics and variance reduction moments of one block of paths drawn from its own generator
+def _simulate_block(simmapping: SimMapping, nbPaths: int, seed: np.random.SeedSequence, simconfig: SimulationConfig):
+    stats = SimStats(CI=simconfig.ConfidenceLevel, snapshotsims=simconfig.SnapshotSims, goal=simconfig.Goal)
+    simOutput, block_stats = simmapping.evaluate_block_stats(nbPaths, np.random.default_rng(seed))
+    stats.StoreBlock(simOutput)
+    return stats, block_stats
@@ -0,0 +1,85 @@
+import numpy as np
+
+from sde.process_base import SDEProcess
+from sde.gbm_process import SimGBM
+from sde.scheme import LogEuler
+from qf.models.mkt_instrument_base import MktInstrument
+from qf.models.blackscholes import BS
+
+"""
+Variance reduction for SimMapping
+The processes draw their Brownian increments through rng.standard_normal, so the techniques are wrappers around the
+generator
+- antithetic: half of the paths use -Z of the other half, path i is paired with path i + nbPaths/2
+- moment matching: the normals of each time step are shifted and scaled to sample mean 0 and variance 1
+- control variate: the draws are recorded and replayed to a control process priced with a known mean
+"""
+class RecordedNormals:
+    def __init__(self, rng = None, antithetic = False, moment_matching = False):
+        self._rng = np.random if rng is None else rng
+        self._antithetic = antithetic
+        self._moment_matching = moment_matching
+        self._draws = []
+
+    def standard_normal(self, size):
+        if self._antithetic:
+            assert size[0]%2 == 0, f"antithetic draws need an even number of paths, input was {size[0]}"
+            Z = self._rng.standard_normal(size=(size[0]//2,) + tuple(size[1:]))
+            Z = np.concatenate([Z, -Z], axis=0)
+        else:
+            Z = self._rng.standard_normal(size=size)
+
+        if self._moment_matching:
+            Z = (Z - np.mean(Z, axis=0))/np.std(Z, axis=0)
+
+        self._draws.append(Z)
+        return Z
+
+    #the same draws again, in the order they were made
+    def replay(self):
+        return ReplayedNormals(self._draws)
+
+class ReplayedNormals:
+    def __init__(self, draws: list):
+        self._draws = list(draws)
+
+    def standard_normal(self, size):
+        Z = self._draws.pop(0)
+        assert Z.shape == tuple(size), f"replayed draws of shape {Z.shape} do not match the request {tuple(size)}"
+        return Z
+
+"""Control instrument priced on a process driven by the same draws as the target, Mean is its known price
+"""
+class ControlVariate:
+    def __init__(self, underlying_process: SDEProcess, mkt_instrument: MktInstrument, mean: float):
+        self._underlying_process = underlying_process
+        self._mkt_instrument = mkt_instrument
+        self._mean = mean
+
+    @property
+    def Mean(self):
+        return self._mean
+
+    def evaluate_block(self, nbPaths: int, rng):
+        cashflow_times,underlying_values = self._underlying_process.Xt_paths(self._mkt_instrument.Spot, self._mkt_instrument.CashflowTimes, nbPaths, rng)
+        return self._mkt_instrument.NPV(cashflow_times,underlying_values).reshape(nbPaths)
+
+"""Black Scholes control for a CEV instrument
+- GBM with the CEV local vol at the spot, sig*S0^(beta/2 - 1), the two are almost perfectly correlated for beta near 2
+- stepped with log-Euler on the grid of the CEV process, exact for GBM so the control mean is the analytical BS price
+"""
+def bs_control_variate(mkt_instrument: MktInstrument, underlying_process: SDEProcess):
+    bs_vol = mkt_instrument.Q_vol*(mkt_instrument.Spot**(mkt_instrument.Power - 1.0))
+    bs_instrument = BS(spot=mkt_instrument.Spot,
+                       sig=bs_vol,
+                       r=mkt_instrument.Rate,
+                       q=mkt_instrument.Dividend,
+                       option=mkt_instrument.Option
+                       )
+    control_process = SimGBM(drift=bs_instrument.Q_drift,
+                             vol=bs_vol,
+                             scheme=LogEuler(),
+                             dt=underlying_process.Dt,
+                             nbSteps=underlying_process.NbSteps
+                             )
+    return ControlVariate(control_process, bs_instrument, bs_instrument.Analytical_NPV())
@@ -5,6 +5,68 @@ from scipy.stats import norm
 from qf.models.mkt_instrument_base import MktInstrument
 from qf.pricing_util.option import Option
 
+"""
+Black Scholes price on arrays, all inputs broadcast against each other
+- payoff_type is 'call' or 'put'
+- q is a continuous dividend yield
+"""
+def bs_analytical_npv(payoff_type: str, spot, strike, expiry, sig, r, q = 0.0):
+    spot = np.asarray(spot, dtype=float)
+    strike = np.asarray(strike, dtype=float)
+    expiry = np.asarray(expiry, dtype=float)
+    sig = np.asarray(sig, dtype=float)
+
+    vol_sqrt_t = sig*np.sqrt(expiry)
+    d1 = (np.log(spot/strike) + (r - q + 0.5*sig*sig)*expiry)/vol_sqrt_t
+    d2 = d1 - vol_sqrt_t
+    discounted_spot = spot*np.exp(-q*expiry)
+    discounted_strike = strike*np.exp(-r*expiry)
+
+    if payoff_type == 'call':
+        return norm.cdf(d1)*discounted_spot - norm.cdf(d2)*discounted_strike
+    elif payoff_type == 'put':
+        return -norm.cdf(-d1)*discounted_spot + norm.cdf(-d2)*discounted_strike
+    raise ValueError(f"payoff_type must be 'call' or 'put', input was {payoff_type}")
+
+def bs_vega(spot, strike, expiry, sig, r, q = 0.0):
+    spot = np.asarray(spot, dtype=float)
+    expiry = np.asarray(expiry, dtype=float)
+    sig = np.asarray(sig, dtype=float)
+
+    vol_sqrt_t = sig*np.sqrt(expiry)
+    d1 = (np.log(spot/strike) + (r - q + 0.5*sig*sig)*expiry)/vol_sqrt_t
+    return spot*np.exp(-q*expiry)*norm.pdf(d1)*np.sqrt(expiry)
+
+"""
+Implied vol on arrays, Newton steps on bs_analytical_npv kept inside a bisection bracket [vol_min, vol_max]
+- stops once every vol moves by less than tol
+- prices outside the no-arbitrage bounds (or not reached within the bracket) return nan
+"""
+def bs_implied_vol(payoff_type: str, price, spot, strike, expiry, r, q = 0.0, tol = 1e-10, max_iter = 100,
+                   vol_min = 1e-6, vol_max = 5.0):
+    price, spot, strike, expiry = np.broadcast_arrays(np.asarray(price, dtype=float), np.asarray(spot, dtype=float),
+                                                      np.asarray(strike, dtype=float), np.asarray(expiry, dtype=float))
+    low = np.full(price.shape, vol_min)
+    high = np.full(price.shape, vol_max)
+    attainable = (bs_analytical_npv(payoff_type, spot, strike, expiry, low, r, q) <= price) \
+                 & (price <= bs_analytical_npv(payoff_type, spot, strike, expiry, high, r, q))
+
+    vol = np.full(price.shape, 0.2)
+    for iteration in range(0, max_iter):
+        diff = bs_analytical_npv(payoff_type, spot, strike, expiry, vol, r, q) - price
+        high = np.where(diff > 0.0, vol, high)
+        low = np.where(diff > 0.0, low, vol)
+        vega = bs_vega(spot, strike, expiry, vol, r, q)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            newton = vol - diff/vega
+        vol_next = np.where((newton > low) & (newton < high), newton, 0.5*(low + high))
+        converged = (np.abs(vol_next - vol) < tol) | (diff == 0.0) | ~attainable
+        vol = vol_next
+        if np.all(converged):
+            break
+
+    return np.where(attainable, vol, np.nan)
+
 class BS(MktInstrument):
     def __init__(self,spot: float,
                  sig: float,
@@ -47,27 +109,31 @@ class BS(MktInstrument):
     def CashflowTimes(self):
         return self._cashflow_times
 
+    @property
+    def Option(self):
+        return self._option
+
     def _initialise(self):
-        self._volsqrtT = self._sig*math.sqrt(self._option.Exercise)
-        self._part_d1 = (self._r- self._q + (self._sig**2)/2.0)*self._option.Exercise
-        self._discountedStrike = self._option.Strike*math.exp(-(self._r - self._q)*self._option.Exercise)
+        self._discount = math.exp(-self._r*self._option.Exercise)
 
     def PayOff(self, underlying: float):
         return self._option.PayOff(underlying)
 
+    #discounted payoff per path, underlying_values has one row per path (or is a single path)
     def NPV(self, realisation_times: np.ndarray, underlying_values: np.ndarray):
-        #not ideal, equal comparison with float values
-        terminal_value = underlying_values[np.where(realisation_times == self._option.Exercise)]
-        return self._option.PayOff(terminal_value)*math.exp(-(self._r - self._q)*self._option.Exercise)
+        terminal_value = underlying_values[..., self.CashflowIndex(realisation_times)[0]]
+        return self._option.PayOff(terminal_value)*self._discount
 
-    def Analytical_NPV(self):
-        d1 = (math.log(self.Spot/self._option.Strike) + self._part_d1)/self._volsqrtT
-        d2 = d1 - self._volsqrtT
+    def NPV_Deriv(self, realisation_times: np.ndarray, underlying_values: np.ndarray):
+        index = self.CashflowIndex(realisation_times)[0]
+        deriv = np.zeros_like(underlying_values, dtype=float)
+        deriv[..., index] = self._option.PayOffDeriv(underlying_values[..., index])*self._discount
+        return deriv
 
-        if self._option.PayOffType == 'call':
-            return norm.cdf(d1)*self.Spot - norm.cdf(d2)*self._discountedStrike
-        elif self._option.PayOffType == 'put':
-            return -norm.cdf(-d1)*self.Spot + norm.cdf(-d2)*self._discountedStrike
+    def Analytical_NPV(self):
+        assert self._option.ExerciseStyle == 'european', f"closed form for European options only, exercise style was {self._option.ExerciseStyle}"
+        return bs_analytical_npv(self._option.PayOffType, self.Spot, self._option.Strike, self._option.Exercise,
+                                 self._sig, self._r, self._q)
 
 if __name__ == "__main__":
     from qf.pricing_util.option import EuropeanOption
@@ -1,32 +1,88 @@
+import functools
 import math
+from scipy.optimize import brentq
 from scipy.stats import norm
 import numpy as np
 
 from qf.models.mkt_instrument_base import MktInstrument
+from qf.models.nc_chi_squ import nc_chi_squ_cdf, select_nc_chi_squ_cdf
 from qf.pricing_util.option import Option
 
 """
-Approximations to the non-central chi-square distribution have been developed.
-One particularly good approximation is derived by Sankaran (1963) - Sankaran, M., (1963), “Approximations to the Non-Central Chi-Square Distribution,”
-Biometrika, 50, 199-204.
+The non-central chi-square cdf has several backends (see qf.models.nc_chi_squ), Sankaran (1963) is the default.
 
 Extending on: Andersen, L. & Andreasen, J. (2000), ‘Volatility Skews and Extensions of the Libor Market Model’,
 Applied Mathematical Finance 7 , 1–32
 Theorem 3 - following these notes here
 Analytical solution to European Call using the CEV model showing CEV equivalence
 https://www.dropbox.com/s/bqalu6cihynb8ui/CEVequivalence.pdf?dl=0
+
+Parameters of the non-central chi-square representation of the CEV terminal distribution, on arrays
+- k is the scaling, x the (scaled) forward spot and y the (scaled) strike term
+- the limit r = q is handled, growth/(exp(growth) - 1) -> 1
 """
-def nc_chi_squ_cdf(z: float, k: float, v: float):
-    h = 1.0 - (2.0 / 3.0) * (v + k) * (3.0 * v + k)
-    h /= ((2.0 * v + k) ** 2.0)
-    p = (2.0 * v + k) / ((v + k) ** 2.0)
-    m = (h - 1.0) * (1.0 - 3.0 * h)
+def cev_k(sig, beta, r, q, expiry):
+    growth = np.asarray((r - q)*expiry*(2.0 - beta), dtype=float)
+    safe_growth = np.where(growth == 0.0, 1.0, growth)
+    growth_ratio = np.where(growth == 0.0, 1.0, safe_growth/np.expm1(safe_growth))
+    return 2.0*growth_ratio/(sig*sig*((2.0 - beta)**2.0)*expiry)
+
+def cev_x(k, spot, beta, r, q, expiry):
+    return k*(spot**(2.0 - beta))*np.exp((r - q)*expiry*(2.0 - beta))
 
-    numer = h * p * (1.0 - h + (2.0 - h) * m * p / 2.0)
-    numer = numer - 1.0+ (z / (v + k)) ** h
-    denom = h * math.sqrt(2.0 * p * (1.0 + m * p))
+def cev_y(k, strike, beta):
+    return k*(strike**(2.0 - beta))
+
+"""
+CEV price on arrays (Schroder's formulation, 0 <= beta < 2), all inputs broadcast against each other
+- payoff_type is 'call' or 'put'
+- cdf_backend names the non-central chi-square backend, cdf_tol its target accuracy
+"""
+def cev_analytical_npv(payoff_type: str, spot, strike, expiry, sig, beta, r, q = 0.0, cdf_backend = 'sankaran', cdf_tol = 1e-12):
+    spot = np.asarray(spot, dtype=float)
+    strike = np.asarray(strike, dtype=float)
+    expiry = np.asarray(expiry, dtype=float)
+    beta = np.asarray(beta, dtype=float)
+
+    k = cev_k(sig, beta, r, q, expiry)
+    x = cev_x(k, spot, beta, r, q, expiry)
+    y = cev_y(k, strike, beta)
+    two_on_two_minus_beta = 2.0/(2.0 - beta)
+    discounted_spot = spot*np.exp(-q*expiry)
+    discounted_strike = strike*np.exp(-r*expiry)
+
+    def cdf(z, df, nc):
+        return nc_chi_squ_cdf(z, df, nc, backend=cdf_backend, tol=cdf_tol)
+
+    if payoff_type == 'call':
+        return discounted_spot * (1.0 - cdf(2.0*y, 2.0 + two_on_two_minus_beta, 2.0*x)) \
+               - discounted_strike * cdf(2.0*x, two_on_two_minus_beta, 2.0*y)
+    elif payoff_type == 'put':
+        return -discounted_spot * cdf(2.0*y, 2.0 + two_on_two_minus_beta, 2.0*x) \
+               + discounted_strike * (1.0 - cdf(2.0*x, two_on_two_minus_beta, 2.0*y))
+    raise ValueError(f"payoff_type must be 'call' or 'put', input was {payoff_type}")
 
-    return norm.cdf(numer / denom)
+"""
+Distribution of the CEV underlying at expiry (absorbed at zero)
+- P(S_T > s) = F(2x; 2/(2 - beta), 2y(s)), the probability in the strike term of the call price
+- cev_upper_quantile is the level the underlying ends above with probability tail_prob
+"""
+def cev_survival(s, spot, expiry, sig, beta, r, q = 0.0, cdf_backend = 'scipy', cdf_tol = 1e-12):
+    k = cev_k(sig, beta, r, q, expiry)
+    x = cev_x(k, spot, beta, r, q, expiry)
+    y = cev_y(k, np.asarray(s, dtype=float), beta)
+    return nc_chi_squ_cdf(2.0*x, 2.0/(2.0 - beta), 2.0*y, backend=cdf_backend, tol=cdf_tol)
+
+#cached, the FDM engines of one instrument on several grids share the far boundary
+@functools.lru_cache(maxsize=256)
+def cev_upper_quantile(tail_prob, spot, expiry, sig, beta, r, q = 0.0):
+    def excess(log_s):
+        return float(cev_survival(math.exp(log_s), spot, expiry, sig, beta, r, q)) - tail_prob
+
+    upper = math.log(spot)
+    while excess(upper) > 0.0:
+        upper += math.log(2.0)
+    return math.exp(brentq(excess, upper - math.log(2.0), upper)) if upper > math.log(spot) else spot
 
 """
 Schroder’s Formulation
@@ -53,9 +109,13 @@ class CEV_Opt(MktInstrument):
                  beta: float,
                  r: float,
                  q: float,
-                 option: Option):
+                 option: Option,
+                 cdf_tol = None):
         MktInstrument.__init__(self, spot)
         self._spot = spot
+        #fastest non-central chi-square backend meeting cdf_tol, Sankaran if no tolerance is requested
+        self._cdf_tol = 1e-12 if cdf_tol is None else cdf_tol
+        self._cdf_backend = 'sankaran' if cdf_tol is None else select_nc_chi_squ_cdf(cdf_tol)
 
         self._sig = sig
         self._beta = beta
@@ -91,44 +151,59 @@ class CEV_Opt(MktInstrument):
     def Power(self):
         return self._beta/2.0
 
+    @property
+    def Rate(self):
+        return self._r
+
+    @property
+    def Dividend(self):
+        return self._q
+
+    @property
+    def Option(self):
+        return self._option
+
     @property
     def CashflowTimes(self):
         return self._cashflow_times
 
+    @property
+    def CdfBackend(self):
+        return self._cdf_backend
+
     def _compute_k(self):
-        numer = 2.0*(self._r - self._q)
-        denom = self._sig*self._sig*(2.0 - self._beta)*(math.exp((self._r - self._q)*self._option.Exercise*(2.0 - self._beta))-1.0)
-        return numer / denom
+        return float(cev_k(self._sig, self._beta, self._r, self._q, self._option.Exercise))
 
     def _compute_x(self):
-        x = self._k*(self._spot ** (2.0 - self._beta))*math.exp((self._r - self._q)*self._option.Exercise*(2.0 - self._beta))
-        return x
+        return float(cev_x(self._k, self._spot, self._beta, self._r, self._q, self._option.Exercise))
 
     def _compute_y(self):
-        y = self._k*(self._option.Strike**(2.0 - self._beta))
-        return y
+        return float(cev_y(self._k, self._option.Strike, self._beta))
 
     def _initialise(self):
         self._k = self._compute_k()
         self._x = self._compute_x()
         self._y = self._compute_y()
+        self._discount = math.exp(-self._r * self._option.Exercise)
 
     def PayOff(self, underlying: float):
         return self._option.PayOff(underlying)
 
     def Analytical_NPV(self):
-        two_on_two_minus_beta = 2.0/(2.0 - self._beta)
-        if self._option.PayOffType == 'call':
-            return self._spot * math.exp(-self._q*self._option.Exercise) * (1.0-nc_chi_squ_cdf(2.0*self._y, 2.0 + two_on_two_minus_beta,2.0*self._x)) \
-                   - self._option.Strike * math.exp(-self._r * self._option.Exercise) * (nc_chi_squ_cdf(2.0*self._x, two_on_two_minus_beta, 2.0*self._y))
-        elif self._option.PayOffType == 'put':
-            return -self._spot * math.exp(-self._q*self._option.Exercise) * (nc_chi_squ_cdf(2.0*self._y, 2.0 + two_on_two_minus_beta,2.0*self._x)) \
-                   + self._option.Strike * math.exp(-self._r * self._option.Exercise) * (1.0-nc_chi_squ_cdf(2.0*self._x, two_on_two_minus_beta, 2.0*self._y))
+        assert self._option.ExerciseStyle == 'european', f"closed form for European options only, exercise style was {self._option.ExerciseStyle}"
+        return cev_analytical_npv(self._option.PayOffType, self._spot, self._option.Strike, self._option.Exercise,
+                                  self._sig, self._beta, self._r, self._q, self._cdf_backend, self._cdf_tol)
 
+    #discounted payoff per path, underlying_values has one row per path (or is a single path)
     def NPV(self, cashflow_times: np.ndarray, underlying_values: np.ndarray):
-        # not ideal, equal comparison with float values
-        terminal_value = underlying_values[np.where(cashflow_times == self._option.Exercise)]
-        return self._option.PayOff(terminal_value) * math.exp(-self._r * self._option.Exercise)
+        terminal_value = underlying_values[..., self.CashflowIndex(cashflow_times)[0]]
+        return self._option.PayOff(terminal_value) * self._discount
+
+    def NPV_Deriv(self, cashflow_times: np.ndarray, underlying_values: np.ndarray):
+        index = self.CashflowIndex(cashflow_times)[0]
+        deriv = np.zeros_like(underlying_values, dtype=float)
+        deriv[..., index] = self._option.PayOffDeriv(underlying_values[..., index]) * self._discount
+        return deriv
 
 if __name__ == "__main__":
     from qf.pricing_util.option import EuropeanOption
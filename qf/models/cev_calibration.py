@@ -0,0 +1,107 @@
+import numpy as np
+from scipy.optimize import least_squares
+
+from qf.models.blackscholes import bs_analytical_npv, bs_vega
+from qf.models.cev import cev_analytical_npv
+
+"""
+Calibration of the CEV (sig, beta) to a surface of European quotes, one set of parameters for all strikes and expiries
+- the whole surface is priced in one call of the vectorised pricer (cev_analytical_npv), puts from calls by parity
+- the Jacobian is a batched forward difference, the surface at both bumped parameters is priced in a single call
+- quotes are prices, or BS implied vols converted to prices once and fitted with residuals divided by the BS vega
+  (first order implied vol residuals, no implied vol inversion inside the solver)
+- each fit starts from the previous one, intraday refits take a few iterations
+"""
+class CEVCalibrator:
+    def __init__(self, spot: float, r: float, q: float = 0.0, cdf_backend = 'scipy', cdf_tol = 1e-12, bump = 1e-6,
+                 max_beta = 1.99):
+        self._spot = spot
+        self._r = r
+        self._q = q
+        self._cdf_backend = cdf_backend
+        self._cdf_tol = cdf_tol
+        self._bump = bump
+        self._max_beta = max_beta
+        self._fit = None
+        self._rmse = None
+        self._nbEvaluations = 0
+
+        assert (self._max_beta > 0.0) & (self._max_beta < 2.0), f"max_beta must be > 0 and < 2, input was {self._max_beta}"
+
+    @property
+    def Sig(self):
+        return self._fit[0]
+
+    @property
+    def Beta(self):
+        return self._fit[1]
+
+    #root mean square residual of the last fit, in price or vol units
+    @property
+    def RMSE(self):
+        return self._rmse
+
+    @property
+    def NbEvaluations(self):
+        return self._nbEvaluations
+
+    """Model prices of the quotes, sig and beta broadcast against the quotes
+    """
+    def model_prices(self, payoff_types, strikes, expiries, sig, beta):
+        calls = cev_analytical_npv('call', self._spot, strikes, expiries, sig, beta, self._r, self._q,
+                                   self._cdf_backend, self._cdf_tol)
+        parity = self._spot*np.exp(-self._q*expiries) - strikes*np.exp(-self._r*expiries)
+        return np.where(payoff_types == 'call', calls, calls - parity)
+
+    def _bs_prices(self, payoff_types, strikes, expiries, vols):
+        calls = bs_analytical_npv('call', self._spot, strikes, expiries, vols, self._r, self._q)
+        parity = self._spot*np.exp(-self._q*expiries) - strikes*np.exp(-self._r*expiries)
+        return np.where(payoff_types == 'call', calls, calls - parity)
+
+    #start value without a previous fit, beta = 1 and sig matching the mean implied vol at the spot
+    def _initial_guess(self, vols):
+        atm_vol = 0.2 if vols is None else np.mean(vols)
+        return np.array([atm_vol*np.sqrt(self._spot), 1.0])
+
+    """Least squares fit, returns (sig, beta)
+    - payoff_types: 'call'/'put' per quote or one for all
+    - prices or vols: market quotes, exactly one of them
+    - initial: start value, defaults to the previous fit
+    """
+    def calibrate(self, payoff_types, strikes, expiries, prices = None, vols = None, initial = None):
+        assert (prices is None) != (vols is None), "give either prices or vols"
+        strikes = np.asarray(strikes, dtype=float)
+        expiries = np.asarray(expiries, dtype=float)
+        payoff_types = np.broadcast_to(np.asarray(payoff_types), strikes.shape)
+
+        if vols is not None:
+            vols = np.asarray(vols, dtype=float)
+            prices = self._bs_prices(payoff_types, strikes, expiries, vols)
+            scale = bs_vega(self._spot, strikes, expiries, vols, self._r, self._q)
+        else:
+            prices = np.asarray(prices, dtype=float)
+            scale = np.ones(prices.shape)
+
+        if initial is None:
+            initial = self._fit if self._fit is not None else self._initial_guess(vols)
+        initial = np.array([initial[0], min(initial[1], self._max_beta)])
+        nbQuotes = strikes.shape[0]
+
+        def residuals(params):
+            self._nbEvaluations += 1
+            return (self.model_prices(payoff_types, strikes, expiries, params[0], params[1]) - prices)/scale
+
+        #surface at (sig + h, beta) and (sig, beta + h) priced together
+        def jacobian(params):
+            h = np.array([self._bump*params[0], self._bump if params[1] + self._bump <= self._max_beta else -self._bump])
+            base = self.model_prices(payoff_types, strikes, expiries, params[0], params[1])
+            bumped = self.model_prices(np.tile(payoff_types, 2), np.tile(strikes, 2), np.tile(expiries, 2),
+                                       np.repeat([params[0] + h[0], params[0]], nbQuotes),
+                                       np.repeat([params[1], params[1] + h[1]], nbQuotes))
+            return ((bumped.reshape(2, nbQuotes) - base)/h[:, None]/scale).T
+
+        result = least_squares(residuals, initial, jac=jacobian, bounds=([1e-8, 0.0], [np.inf, self._max_beta]),
+                               x_scale='jac')
+        self._fit = result.x
+        self._rmse = np.sqrt(np.mean(result.fun*result.fun))
+        return self._fit
@@ -1,8 +1,12 @@
 import numpy as np
 
+#tolerance (in years) when matching cashflow times to simulated times
+CASHFLOW_TIME_TOL = 1e-9
+
 class MktInstrument:
     def __init__(self,spot: float):
         self._spot = spot
+        self._index_cache = (None, None)
 
     @property
     def Spot(self):
@@ -32,8 +36,30 @@ class MktInstrument:
     def CashflowTimes(self):
         pass
 
+    @property
+    def Option(self):
+        pass
+
     def PayOff(self):
         pass
 
+    """Column of each cashflow time in a simulated time grid (sorted), matched within CASHFLOW_TIME_TOL
+    - computed once per grid, the grid of the last call is keyed on its contents (a copy of the same times hits)
+    """
+    def CashflowIndex(self, times: np.ndarray):
+        times = np.asarray(times, dtype=float)
+        key, index = self._index_cache
+        if key != (times.tobytes(), times.shape):
+            cashflow_times = self.CashflowTimes
+            index = np.clip(np.searchsorted(times, cashflow_times - CASHFLOW_TIME_TOL), 0, times.shape[0] - 1)
+            assert np.all(np.abs(times[index] - cashflow_times) <= CASHFLOW_TIME_TOL), f"cashflow times {cashflow_times} are not simulated"
+            self._index_cache = ((times.tobytes(), times.shape), index)
+        return index
+
     def NPV(self, realisation_times: np.ndarray, underlying_values: np.ndarray):
+        pass
+
+    """Derivative of NPV in each column of underlying_values, same shape, for pathwise greeks
+    """
+    def NPV_Deriv(self, realisation_times: np.ndarray, underlying_values: np.ndarray):
         pass
\ No newline at end of file
@@ -1,3 +1,5 @@
+import numpy as np
+
 from .payoff import PayOff
 
 class Option:
@@ -9,6 +11,16 @@ class Option:
     def Exercise(self):
         pass
 
+    #'european', 'american' or 'bermudan'
+    @property
+    def ExerciseStyle(self):
+        pass
+
+    #array of the times the option can be exercised at, the (start, end) tuple of the interval for an American option
+    @property
+    def ExerciseTimes(self):
+        pass
+
     @property
     def PayOffType(self):
         return self._payoff.Type
@@ -24,6 +36,9 @@ class Option:
     def PayOff(self, spot: float):
         return self._payoff(spot)
 
+    def PayOffDeriv(self, spot: float):
+        return self._payoff.Deriv(spot)
+
 class EuropeanOption(Option):
     def __init__(self, payoff: PayOff, expiry: float):
         self._exercise = expiry
@@ -31,4 +46,54 @@ class EuropeanOption(Option):
 
     @property
     def Exercise(self):
-        return self._exercise
\ No newline at end of file
+        return self._exercise
+
+    @property
+    def ExerciseStyle(self):
+        return 'european'
+
+    @property
+    def ExerciseTimes(self):
+        return np.array([self._exercise])
+
+"""Exercisable at any time up to the expiry, Exercise is the last exercise time
+"""
+class AmericanOption(Option):
+    def __init__(self, payoff: PayOff, expiry: float):
+        self._exercise = expiry
+        Option.__init__(self, payoff, expiry)
+
+    @property
+    def Exercise(self):
+        return self._exercise
+
+    @property
+    def ExerciseStyle(self):
+        return 'american'
+
+    #start and end of the interval exercise is continuous over, not two exercise dates
+    @property
+    def ExerciseTimes(self):
+        return np.array([0.0, self._exercise])
+
+"""Exercisable at the given times only, the expiry is the last of them
+"""
+class BermudanOption(Option):
+    def __init__(self, payoff: PayOff, exercise_times):
+        self._exercise_times = np.sort(np.asarray(exercise_times, dtype=float))
+        self._exercise = float(self._exercise_times[-1])
+        Option.__init__(self, payoff, self._exercise)
+
+        assert self._exercise_times[0] >= 0.0, f"exercise times must be >= 0, input was {self._exercise_times}"
+
+    @property
+    def Exercise(self):
+        return self._exercise
+
+    @property
+    def ExerciseStyle(self):
+        return 'bermudan'
+
+    @property
+    def ExerciseTimes(self):
+        return self._exercise_times
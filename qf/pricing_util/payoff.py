@@ -1,3 +1,5 @@
+import numpy as np
+
 
 class PayOff:
     def __init__(self, strike: float):
@@ -10,6 +12,10 @@ class PayOff:
     def __call__(self, spot: float):
         pass
 
+    #derivative in the spot, taken as 0 at the strike
+    def Deriv(self, spot: float):
+        pass
+
 class PayOffCall(PayOff):
     def __init__(self, strike: float):
         self._type = 'call'
@@ -20,7 +26,10 @@ class PayOffCall(PayOff):
         return self._type
 
     def __call__(self, spot: float):
-        return max(spot - self._strike, 0.0)
+        return np.maximum(spot - self._strike, 0.0)
+
+    def Deriv(self, spot: float):
+        return np.where(spot > self._strike, 1.0, 0.0)
 
 class PayOffPut(PayOff):
     def __init__(self, strike: float):
@@ -32,4 +41,7 @@ class PayOffPut(PayOff):
         return self._type
 
     def __call__(self, spot: float):
-        return max(self._strike - spot, 0.0)
\ No newline at end of file
+        return np.maximum(self._strike - spot, 0.0)
+
+    def Deriv(self, spot: float):
+        return np.where(spot < self._strike, -1.0, 0.0)
@@ -1,13 +1,90 @@
-import math
 import numpy as np
 
 from .process_base import SDEProcess
+from .scheme import Scheme
+from qf.models.cev import cev_k, cev_x
 
 class CEV(SDEProcess):
+    """scheme, dt and nbSteps set the time stepping, see SDEProcess
+    - the local vol vanishes at zero, Euler and Milstein paths can cross it unless the scheme has a boundary
+    """
+    def __init__(self, drift: float, vol: float, power: float, scheme: Scheme = None, dt: float = 0.01, nbSteps: int = None):
+        SDEProcess.__init__(self,init_drift = drift,init_vol = vol, scheme = scheme, dt = dt, nbSteps = nbSteps)
+        self._power = power
+
+    @property
+    def Drift(self):
+        return self._drift
+
+    @property
+    def Vol(self):
+        return self._vol
+
+    @property
+    def Power(self):
+        return self._power
+
+    @property
+    def Stepped(self):
+        return True
+
+    def LocalDrift(self, X: np.ndarray):
+        return self.Drift*X
+
+    def LocalVol(self, X: np.ndarray):
+        return self.Vol*(X**self.Power)
+
+    def LocalVolDeriv(self, X: np.ndarray):
+        positive = X > 0.0
+        return np.where(positive, self.Power*self.Vol*(np.where(positive, X, 1.0)**(self.Power - 1.0)), 0.0)
+
+    def LocalDriftDeriv(self, X: np.ndarray):
+        return self.Drift*np.ones_like(X)
+
+    def LocalVolDeriv2(self, X: np.ndarray):
+        positive = X > 0.0
+        return np.where(positive, self.Power*(self.Power - 1.0)*self.Vol*(np.where(positive, X, 1.0)**(self.Power - 2.0)), 0.0)
+
+    #b = vol X^power, derivatives in vol and power
+    def LocalVolParamDerivs(self, X: np.ndarray):
+        positive = X > 0.0
+        X_pos = np.where(positive, X, 1.0)
+        log_X = np.log(X_pos)
+        X_power = np.where(positive, X_pos**self.Power, 0.0)
+        X_power_1 = X_power/X_pos
+        return {'vol': (X_power, self.Power*X_power_1),
+                'power': (self.Vol*X_power*log_X, self.Vol*X_power_1*(1.0 + self.Power*log_X))}
+
+    """Terminal value
+    """
+    def Xt(self, X0: float, times: np.ndarray):
+        sim_times, X_t = self._step_paths(X0, times, 1)
+        return sim_times, X_t[0]
+
+    """Block of paths, all paths stepped together on a grid through the times, the values at the times are kept
+    - rng is any object with a standard_normal method (np.random.Generator), defaults to the global np.random state
+    """
+    def Xt_paths(self, X0: float, times: np.ndarray, nbPaths: int, rng = None):
+        return self._step_paths(X0, times, nbPaths, rng)
+
+    def Xt_paths_full(self, X0: float, times: np.ndarray, nbPaths: int, rng = None):
+        return self._step_paths(X0, times, nbPaths, rng, keep_path=True)
+
+
+"""Exact CEV sampler, 0 <= power < 1 (beta = 2*power < 2), absorbed at zero
+Uses the non-central chi-square representation of the CEV transition (the k, x of CEV_Opt). With a = 1/(2 - beta),
+Y = k*S_t^(2-beta) is zero (absorbed) with probability Q(a, x) and otherwise has the Poisson-Gamma mixture density
+sum_n e^-x x^(n+a)/Gamma(n+a+1) * Gamma(n+1). This is drawn exactly by
+    G ~ Gamma(a), absorbed if G > x, else N ~ Poisson(x - G) and Y ~ Gamma(N + 1)
+No time stepping, one transition per observation time, no discretisation bias and no negative values.
+"""
+class CEVExact(SDEProcess):
     def __init__(self, drift: float, vol: float, power: float):
         SDEProcess.__init__(self,init_drift = drift,init_vol = vol)
         self._power = power
 
+        assert (self._power >= 0.0) & (self._power < 1.0), f"Power must be >= 0 and < 1, input was {self._power}"
+
     @property
     def Drift(self):
         return self._drift
@@ -20,26 +97,36 @@ class CEV(SDEProcess):
     def Power(self):
         return self._power
 
-    """Terminal value
+    """Values at the given times only
     """
     def Xt(self, X0: float, times: np.ndarray):
-        dt = 0.01
-        dt_sqrt = math.sqrt(dt)
-
-        """To do: Update to ensure the process is simulated for the specific cashflow times
-            Currently assumes dt is small enough that if you simulate to max time, there will be times
-            sufficiently close to all of the cashflow times
-        """
-        max_sim_time = np.max(times)
-        nbTSteps = int(max_sim_time/float(dt))
-        sim_times = np.linspace(start=dt,stop=max_sim_time,num=nbTSteps)
-
-        # randomness generator
-        dW_t = np.random.normal(size=(nbTSteps)) * dt_sqrt
-        X_t = np.zeros(nbTSteps)
-        X_t[0] = X0
-
-        for timeidx in range(1, nbTSteps):
-            X_t[timeidx] = X_t[timeidx - 1] + X_t[timeidx - 1]*self.Drift * dt + (X_t[timeidx - 1]**self.Power)*self.Vol * dW_t[timeidx - 1]
-
-        return sim_times,X_t
\ No newline at end of file
+        sim_times, X_t = self.Xt_paths(X0, times, 1)
+        return sim_times, X_t[0]
+
+    """Block of paths, one exact transition per observation time
+    - rng is any object with gamma and poisson methods (np.random.Generator), defaults to the global np.random state
+    """
+    def Xt_paths(self, X0: float, times: np.ndarray, nbPaths: int, rng = None):
+        rng = np.random if rng is None else rng
+        sim_times = np.asarray(times, dtype=float)
+        beta = 2.0*self.Power
+        a = 1.0/(2.0 - beta)
+
+        X_t = np.zeros((nbPaths, sim_times.shape[0]))
+        X_prev = np.full(nbPaths, float(X0))
+        t_prev = 0.0
+        for timeidx in range(0, sim_times.shape[0]):
+            dt = sim_times[timeidx] - t_prev
+            k = cev_k(self.Vol, beta, self.Drift, 0.0, dt)
+            x = cev_x(k, X_prev, beta, self.Drift, 0.0, dt)
+
+            G = rng.gamma(a, size=nbPaths)
+            alive = G < x
+            N = rng.poisson(np.where(alive, x - G, 0.0))
+            Y = np.where(alive, rng.gamma(N + 1.0), 0.0)
+
+            X_t[:, timeidx] = (Y/k)**a
+            X_prev = X_t[:, timeidx]
+            t_prev = sim_times[timeidx]
+
+        return sim_times, X_t
@@ -2,6 +2,7 @@ import math
 import numpy as np
 
 from .process_base import SDEProcess
+from .scheme import Scheme
 
 class GBM(SDEProcess):
     def __init__(self, drift: float, vol: float):
@@ -15,6 +16,12 @@ class GBM(SDEProcess):
     def Vol(self):
         return self._vol
 
+    def LocalDrift(self, X: np.ndarray):
+        return self.Drift*X
+
+    def LocalVol(self, X: np.ndarray):
+        return self.Vol*X
+
     """Terminal value
     """
     def Xt(self, X0: float, times: np.ndarray):
@@ -25,9 +32,22 @@ class GBM(SDEProcess):
 
         return times, npX_t(times)
 
+    """Block of paths, exact draws of one path per row through the (increasing) times, the log increments between
+    successive times are independent
+    """
+    def Xt_paths(self, X0: float, times: np.ndarray, nbPaths: int, rng = None):
+        rng = np.random if rng is None else rng
+        times = np.asarray(times, dtype=float)
+        assert np.all(np.diff(np.concatenate([[0.0], times])) > 0.0), f"times must be > 0 and increasing, input was {times}"
+        Z = rng.standard_normal(size=(nbPaths, times.shape[0]))
+        dW = Z * np.sqrt(np.diff(np.concatenate([[0.0], times])))
+        return times, X0 * np.exp((self.Drift - self.Vol*self.Vol/2.0) * times + self.Vol * np.cumsum(dW, axis=1))
+
 class SimGBM(SDEProcess):
-    def __init__(self, drift: float, vol: float):
-        SDEProcess.__init__(self,init_drift = drift,init_vol = vol)
+    """scheme, dt and nbSteps set the time stepping, see SDEProcess
+    """
+    def __init__(self, drift: float, vol: float, scheme: Scheme = None, dt: float = 0.01, nbSteps: int = None):
+        SDEProcess.__init__(self,init_drift = drift,init_vol = vol, scheme = scheme, dt = dt, nbSteps = nbSteps)
 
     @property
     def Drift(self):
@@ -37,27 +57,39 @@ class SimGBM(SDEProcess):
     def Vol(self):
         return self._vol
 
+    @property
+    def Stepped(self):
+        return True
+
+    def LocalDrift(self, X: np.ndarray):
+        return self.Drift*X
+
+    def LocalVol(self, X: np.ndarray):
+        return self.Vol*X
+
+    def LocalVolDeriv(self, X: np.ndarray):
+        return self.Vol*np.ones_like(X)
+
+    def LocalDriftDeriv(self, X: np.ndarray):
+        return self.Drift*np.ones_like(X)
+
+    def LocalVolDeriv2(self, X: np.ndarray):
+        return np.zeros_like(X)
+
+    def LocalVolParamDerivs(self, X: np.ndarray):
+        return {'vol': (X, np.ones_like(X))}
+
     """Terminal value
     """
     def Xt(self, X0: float, times: np.ndarray):
-        #Not ideal, think about adding in a Scheme class to adjust the stepsize
-        dt = 0.01
-        dt_sqrt = math.sqrt(dt)
-
-        """To do: Update to ensure the process is simulated for the specific cashflow times
-            Currently assumes dt is small enough that if you simulate to max time, there will be times
-            sufficiently close to all of the cashflow times
-        """
-        max_sim_time = np.max(times)
-        nbTSteps = int(max_sim_time/float(dt))
-        sim_times = np.linspace(start=dt,stop=max_sim_time,num=nbTSteps)
-
-        # randomness generator
-        dW_t = np.random.normal(size=(nbTSteps)) * dt_sqrt
-        X_t = np.zeros(nbTSteps)
-        X_t[0] = X0
-
-        for timeidx in range(1, nbTSteps):
-            X_t[timeidx] = X_t[timeidx - 1] + X_t[timeidx - 1]*self.Drift * dt + X_t[timeidx - 1]*self.Vol * dW_t[timeidx - 1]
-
-        return sim_times,X_t
\ No newline at end of file
+        sim_times, X_t = self._step_paths(X0, times, 1)
+        return sim_times, X_t[0]
+
+    """Block of paths, all paths stepped together on a grid through the times, the values at the times are kept
+    - rng is any object with a standard_normal method (np.random.Generator), defaults to the global np.random state
+    """
+    def Xt_paths(self, X0: float, times: np.ndarray, nbPaths: int, rng = None):
+        return self._step_paths(X0, times, nbPaths, rng)
+
+    def Xt_paths_full(self, X0: float, times: np.ndarray, nbPaths: int, rng = None):
+        return self._step_paths(X0, times, nbPaths, rng, keep_path=True)
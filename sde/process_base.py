@@ -1,9 +1,56 @@
+import itertools
+import math
 import numpy as np
 
+from .scheme import Scheme, Euler
+
+"""Normals of each step of a block, one (nbPaths,) column per step in time order
+- a numpy Generator (or the global np.random state) is drawn one step at a time, no (paths, steps) matrix is held and
+  memory per path is set by the kept values, the columns are the rows of a (nbTSteps, nbPaths) draw
+- other sources (SobolNormals, RecordedNormals, ReplayedNormals) are drawn as one (nbPaths, nbTSteps) matrix, they
+  need the whole path at once (Brownian bridge, moment matching, replay by shape)
+"""
+def step_normals(rng, nbPaths: int, nbTSteps: int):
+    if (rng is np.random) or isinstance(rng, np.random.Generator):
+        for timeidx in range(0, nbTSteps):
+            yield rng.standard_normal(size=nbPaths)
+        return
+    Z_t = rng.standard_normal(size=(nbPaths, nbTSteps))
+    for timeidx in range(0, nbTSteps):
+        yield Z_t[:, timeidx]
+
 class SDEProcess:
-    def __init__(self, init_drift: float, init_vol: float):
+    """scheme: discretisation of a time step for processes that are stepped, Euler by default
+       dt: target step size, the step is shrunk so that a whole number of steps ends on the last time
+       nbSteps: number of steps to the last time, overrides dt
+    """
+    def __init__(self, init_drift: float, init_vol: float, scheme: Scheme = None, dt: float = 0.01, nbSteps: int = None):
         self._drift = init_drift
         self._vol = init_vol
+        self._scheme = Euler() if scheme is None else scheme
+        self._dt = dt
+        self._nbSteps = nbSteps
+        self._grid_cache = None
+
+        assert (self._nbSteps is None) or (self._nbSteps > 0), f"nbSteps must be > 0, input was {self._nbSteps}"
+        assert self._dt > 0.0, f"dt must be > 0, input was {self._dt}"
+
+    @property
+    def Scheme(self):
+        return self._scheme
+
+    @property
+    def Dt(self):
+        return self._dt
+
+    @property
+    def NbSteps(self):
+        return self._nbSteps
+
+    #paths are stepped with the scheme (not drawn exactly), tangent paths need it
+    @property
+    def Stepped(self):
+        return False
 
     def Drift(self, t: float):
         pass
@@ -11,5 +58,197 @@ class SDEProcess:
     def Vol(self, t: float):
         pass
 
+    """Coefficients of dX = a(X)dt + b(X)dW used by the schemes, b' is only needed by Milstein
+    """
+    def LocalDrift(self, X: np.ndarray):
+        pass
+
+    def LocalVol(self, X: np.ndarray):
+        pass
+
+    def LocalVolDeriv(self, X: np.ndarray):
+        pass
+
+    """Derivatives for the tangent paths: a'(X), b''(X) (Milstein only) and a dict of (db/dtheta, db'/dtheta) per
+    parameter of the local vol, named as in the constructor
+    """
+    def LocalDriftDeriv(self, X: np.ndarray):
+        pass
+
+    def LocalVolDeriv2(self, X: np.ndarray):
+        pass
+
+    def LocalVolParamDerivs(self, X: np.ndarray):
+        pass
+
     def Xt(self, X0: float, times: np.ndarray):
-        pass
\ No newline at end of file
+        pass
+
+    """Block of paths, one row per path
+    """
+    def Xt_paths(self, X0: float, times: np.ndarray, nbPaths: int, rng = None):
+        pass
+
+    """Step grid from 0 that hits every observation time, returns the step sizes, the times after each step and the
+    step index of each observation time
+    - each interval between observation times is cut into equal steps of about dt (nbSteps: about last time/nbSteps),
+      at least one step per interval
+    - the grid of the last call is kept and handed back while the times and the stepping are unchanged
+    """
+    def _time_grid(self, times: np.ndarray):
+        obs_times = np.asarray(times, dtype=float)
+        key = (obs_times.tobytes(), self._dt, self._nbSteps)
+        if (self._grid_cache is not None) and (self._grid_cache[0] == key):
+            return self._grid_cache[1]
+
+        assert np.all(np.diff(np.concatenate([[0.0], obs_times])) > 0.0), f"times must be > 0 and increasing, input was {obs_times}"
+        target_dt = self._dt if self._nbSteps is None else obs_times[-1]/self._nbSteps
+        intervals = np.diff(np.concatenate([[0.0], obs_times]))
+        nbIntervalSteps = np.maximum(1, np.round(intervals/target_dt)).astype(int)
+        step_dt = np.repeat(intervals/nbIntervalSteps, nbIntervalSteps)
+        sim_times = np.concatenate([np.linspace(start=t_end - interval + interval/nbSteps, stop=t_end, num=nbSteps)
+                                    for t_end, interval, nbSteps in zip(obs_times, intervals, nbIntervalSteps)])
+        obs_idx = np.cumsum(nbIntervalSteps) - 1
+        self._grid_cache = (key, (step_dt, sim_times, obs_idx))
+        return step_dt, sim_times, obs_idx
+
+    """Step a block of paths with the scheme
+    - rng is any object with a standard_normal method (np.random.Generator), defaults to the global np.random state
+    - only the values at the observation times are kept, column i holds the values at times[i]
+    - keep_path keeps every step instead, column i then holds the values at the i-th time of the step grid
+    """
+    def _step_paths(self, X0: float, times: np.ndarray, nbPaths: int, rng = None, keep_path = False):
+        rng = np.random if rng is None else rng
+        step_dt, sim_times, obs_idx = self._time_grid(times)
+        nbTSteps = sim_times.shape[0]
+
+        # randomness generator, the normals are scaled to increments one step at a time
+        Z_t = step_normals(rng, nbPaths, nbTSteps)
+        if keep_path:
+            return sim_times,self._apply_scheme(X0, step_dt, Z_t, np.sqrt(step_dt), nbPaths=nbPaths)
+        return times,self._apply_scheme(X0, step_dt, Z_t, np.sqrt(step_dt), obs_idx, nbPaths)
+
+    """Scheme steps over the increments dW_t*dW_scale (one column per step), dt is the step size or one size per step
+    - dW_t: (nbPaths, nbTSteps) array, or an iterator of the step columns with nbPaths given and dt one per step
+    - dW_scale: scale of the increments, a number or one per step
+    - obs_idx: steps after which the values are kept, every step if None
+    """
+    def _apply_scheme(self, X0: float, dt, dW_t, dW_scale = 1.0, obs_idx: np.ndarray = None, nbPaths: int = None):
+        if isinstance(dW_t, np.ndarray):
+            nbPaths, nbTSteps = dW_t.shape
+            dW_t = dW_t.T
+        else:
+            nbTSteps = np.shape(dt)[0]
+        step_dt = np.broadcast_to(dt, (nbTSteps,))
+        step_scale = np.broadcast_to(dW_scale, (nbTSteps,))
+        obs_idx = np.arange(nbTSteps) if obs_idx is None else obs_idx
+        X_t = np.zeros((nbPaths, obs_idx.shape[0]))
+        X_prev = np.full(nbPaths, float(X0))
+
+        obsidx = 0
+        for timeidx, dW in enumerate(dW_t):
+            X_prev = self._scheme.step(self, X_prev, step_dt[timeidx], dW*step_scale[timeidx])
+            if timeidx == obs_idx[obsidx]:
+                X_t[:, obsidx] = X_prev
+                obsidx += 1
+                if obsidx == obs_idx.shape[0]:
+                    break
+
+        return X_t
+
+    """Block of paths with their tangent paths in one pass over the step grid of _step_paths, for pathwise greeks
+    - returns the times, the values at the times and a dict of tangents at the times, 'spot' Y = dX/dX0 and one per
+      parameter of LocalVolParamDerivs (dX/dvol, dX/dpower, ...)
+    - also returns the likelihood ratio (Bismut-Elworthy-Li) weight of the spot and its derivative in the spot
+          w = 1/T sum_n Y_n dW_n/b(X_n),  dw/dX0 = 1/T sum_n dW_n (Y2_n/b(X_n) - Y_n^2 b'(X_n)/b(X_n)^2)
+      with Y2 = d2X/dX0^2, its step derivative d2X_next/dX^2 is a forward difference (bump*X) of the scheme tangent
+    """
+    def Xt_paths_tangent(self, X0: float, times: np.ndarray, nbPaths: int, rng = None, bump: float = 1e-4):
+        assert self.Stepped, f"tangent paths need a process stepped with a scheme, {type(self).__name__} is not"
+        rng = np.random if rng is None else rng
+        step_dt, sim_times, obs_idx = self._time_grid(times)
+        nbTSteps = sim_times.shape[0]
+
+        X_prev = np.full(nbPaths, float(X0))
+        Y = np.ones(nbPaths)
+        Y2 = np.zeros(nbPaths)
+        Y_params = {name: np.zeros(nbPaths) for name in self.LocalVolParamDerivs(X_prev)}
+        weight = np.zeros(nbPaths)
+        weight_spot = np.zeros(nbPaths)
+        X_t = np.zeros((nbPaths, obs_idx.shape[0]))
+        tangents = {name: np.zeros((nbPaths, obs_idx.shape[0])) for name in ['spot'] + list(Y_params)}
+
+        obsidx = 0
+        for timeidx, Z in enumerate(step_normals(rng, nbPaths, nbTSteps)):
+            dt = step_dt[timeidx]
+            dW = Z*math.sqrt(dt)
+            vol = self.LocalVol(X_prev)
+            safe_vol = np.where(vol != 0.0, vol, 1.0)
+            weight += np.where(vol != 0.0, Y*dW/safe_vol, 0.0)
+            weight_spot += np.where(vol != 0.0, dW*(Y2/safe_vol - Y*Y*self.LocalVolDeriv(X_prev)/(safe_vol*safe_vol)), 0.0)
+
+            X_next, dX, dParams = self._scheme.tangent(self, X_prev, dt, dW)
+            h = bump*np.maximum(np.abs(X_prev), 1.0)
+            dXX = (self._scheme.tangent(self, X_prev + h, dt, dW, params=False)[1] - dX)/h
+            Y2 = dX*Y2 + dXX*Y*Y
+            Y_params = {name: dX*Y_params[name] + dParams[name] for name in Y_params}
+            Y = dX*Y
+            X_prev = X_next
+
+            if timeidx == obs_idx[obsidx]:
+                X_t[:, obsidx] = X_prev
+                tangents['spot'][:, obsidx] = Y
+                for name in Y_params:
+                    tangents[name][:, obsidx] = Y_params[name]
+                obsidx += 1
+
+        T = float(np.asarray(times)[-1])
+        return times, X_t, tangents, weight/T, weight_spot/T
+
+    """Stream of path blocks, yields (times, values) of blockSize paths, the last block takes the remainder
+    - nbPaths None streams until the caller stops
+    - rng is shared by all blocks, or is an iterable with one generator per block
+    - a block is not referenced once the next one is requested, peak memory is set by blockSize, not nbPaths
+    """
+    def iter_blocks(self, X0: float, times: np.ndarray, blockSize: int, nbPaths: int = None, rng = None):
+        assert blockSize > 0, f"blockSize must be > 0, input was {blockSize}"
+        rngs = itertools.repeat(rng) if (rng is None) or hasattr(rng, 'standard_normal') else iter(rng)
+        simsDone = 0
+        while (nbPaths is None) or (simsDone < nbPaths):
+            nbBlock = blockSize if nbPaths is None else min(blockSize, nbPaths - simsDone)
+            yield self.Xt_paths(X0, times, nbBlock, next(rngs))
+            simsDone += nbBlock
+
+    """Block of paths with the value after every step of the grid, returns (step times, values)
+    - exact samplers only simulate the observation times, which are then the whole path
+    """
+    def Xt_paths_full(self, X0: float, times: np.ndarray, nbPaths: int, rng = None):
+        return self.Xt_paths(X0, times, nbPaths, rng)
+
+    """Block of paths stepped with nbSteps steps to the last time, whatever dt and nbSteps of the process
+    """
+    def Xt_paths_steps(self, X0: float, times: np.ndarray, nbPaths: int, nbSteps: int, rng = None):
+        rng = np.random if rng is None else rng
+        max_sim_time = float(np.max(times))
+        dt = max_sim_time/nbSteps
+        dW_t = rng.standard_normal(size=(nbPaths, nbSteps)) * math.sqrt(dt)
+        return np.linspace(start=dt,stop=max_sim_time,num=nbSteps),self._apply_scheme(X0, dt, dW_t)
+
+    """Fine and coarse paths on the same Brownian increments, for multilevel Monte Carlo
+    - the fine paths take nbSteps steps to the last time, the coarse paths nbSteps/refinement steps, each coarse
+      increment is the sum of refinement fine ones
+    - returns (fine times, fine values), (coarse times, coarse values)
+    """
+    def Xt_paths_coupled(self, X0: float, times: np.ndarray, nbPaths: int, nbSteps: int, refinement: int = 2, rng = None):
+        assert nbSteps%refinement == 0, f"nbSteps must be a multiple of the refinement {refinement}, input was {nbSteps}"
+        rng = np.random if rng is None else rng
+        max_sim_time = float(np.max(times))
+        dt = max_sim_time/nbSteps
+        nbCoarseSteps = nbSteps//refinement
+
+        dW_t = rng.standard_normal(size=(nbPaths, nbSteps)) * math.sqrt(dt)
+        dW_coarse = dW_t.reshape(nbPaths, nbCoarseSteps, refinement).sum(axis=2)
+
+        fine_times = np.linspace(start=dt,stop=max_sim_time,num=nbSteps)
+        coarse_times = np.linspace(start=dt*refinement,stop=max_sim_time,num=nbCoarseSteps)
+        return (fine_times, self._apply_scheme(X0, dt, dW_t)), (coarse_times, self._apply_scheme(X0, dt*refinement, dW_coarse))
@@ -0,0 +1,104 @@
+import numpy as np
+
+"""
+Discretisation schemes for one time step of a scalar SDE dX = a(X)dt + b(X)dW, applied to a whole block of paths
+- the process supplies a(X) (LocalDrift), b(X) (LocalVol) and b'(X) (LocalVolDeriv)
+- dW are the Brownian increments of the step, one per path
+- boundary handles paths that cross zero: None leaves them, 'absorb' stops them at zero, 'reflect' mirrors them
+- tangent also returns the derivatives of the step on the same dW, dX_next/dX and dX_next/dtheta for the parameters
+  of process.LocalVolParamDerivs, for the tangent paths of pathwise greeks. A scheme gives the partials of its step in
+  X (coefficients held), a(X), b(X) and b'(X) (None if the step does not use b'), the chain rule adds the process
+  derivatives a'(X), b'(X), b''(X)
+"""
+class Scheme:
+    def __init__(self, boundary = None):
+        self._boundary = boundary
+
+        assert self._boundary in [None, 'absorb', 'reflect'], f"boundary must be None, 'absorb' or 'reflect', input was {self._boundary}"
+
+    @property
+    def Boundary(self):
+        return self._boundary
+
+    def _step(self, process, X: np.ndarray, dt: float, dW: np.ndarray):
+        pass
+
+    def _partials(self, process, X: np.ndarray, X_next: np.ndarray, dt: float, dW: np.ndarray):
+        pass
+
+    def _apply_boundary(self, X: np.ndarray, X_next: np.ndarray):
+        if self._boundary == 'absorb':
+            #once at zero the path stays there
+            return np.where(X > 0.0, np.maximum(X_next, 0.0), 0.0)
+        elif self._boundary == 'reflect':
+            return np.abs(X_next)
+        return X_next
+
+    #derivative of the boundary map at the unbounded step
+    def _boundary_deriv(self, X: np.ndarray, X_next: np.ndarray):
+        if self._boundary == 'absorb':
+            return np.where((X > 0.0) & (X_next > 0.0), 1.0, 0.0)
+        elif self._boundary == 'reflect':
+            return np.sign(X_next)
+        return 1.0
+
+    def step(self, process, X: np.ndarray, dt: float, dW: np.ndarray):
+        return self._apply_boundary(X, self._step(process, X, dt, dW))
+
+    """Step with its derivatives, returns X_next, dX_next/dX and a dict of dX_next/dtheta (empty unless params)
+    """
+    def tangent(self, process, X: np.ndarray, dt: float, dW: np.ndarray, params = True):
+        #paths past the boundary (nan coefficients) get a zero derivative from the boundary map
+        with np.errstate(invalid='ignore', over='ignore'):
+            X_next = self._step(process, X, dt, dW)
+            F_x, F_a, F_b, F_db = self._partials(process, X, X_next, dt, dW)
+            dX = F_x + F_a*process.LocalDriftDeriv(X) + F_b*process.LocalVolDeriv(X)
+            if F_db is not None:
+                dX = dX + F_db*process.LocalVolDeriv2(X)
+            dParams = {name: F_b*db if F_db is None else F_b*db + F_db*d_db
+                       for name, (db, d_db) in process.LocalVolParamDerivs(X).items()} if params else {}
+
+        boundary_deriv = self._boundary_deriv(X, X_next)
+        def bounded(deriv):
+            if self._boundary is None:
+                return deriv
+            return np.where(boundary_deriv != 0.0, deriv*boundary_deriv, 0.0)
+        return self._apply_boundary(X, X_next), bounded(dX), {name: bounded(d) for name, d in dParams.items()}
+
+class Euler(Scheme):
+    def _step(self, process, X: np.ndarray, dt: float, dW: np.ndarray):
+        return X + process.LocalDrift(X)*dt + process.LocalVol(X)*dW
+
+    def _partials(self, process, X: np.ndarray, X_next: np.ndarray, dt: float, dW: np.ndarray):
+        return 1.0, dt, dW, None
+
+"""Euler step on log(X), the path stays positive
+d log X = (a/X - (b/X)^2/2)dt + (b/X)dW, exact for GBM
+- a path that underflows to zero stays at zero, for CEV the log vol overflows first near zero and the step goes to 0
+"""
+class LogEuler(Scheme):
+    def _step(self, process, X: np.ndarray, dt: float, dW: np.ndarray):
+        positive = X > 0.0
+        X_pos = np.where(positive, X, 1.0)
+        with np.errstate(over='ignore', invalid='ignore'):
+            log_vol = process.LocalVol(X_pos)/X_pos
+            X_next = X_pos*np.exp((process.LocalDrift(X_pos)/X_pos - 0.5*log_vol*log_vol)*dt + log_vol*dW)
+        return np.where(positive & np.isfinite(X_next), X_next, 0.0)
+
+    #X_next = X exp(g), g = (a/X - (b/X)^2/2)dt + (b/X)dW, zero where the step is
+    def _partials(self, process, X: np.ndarray, X_next: np.ndarray, dt: float, dW: np.ndarray):
+        X_pos = np.where(X > 0.0, X, 1.0)
+        ratio = np.where(X > 0.0, X_next/X_pos, 0.0)
+        drift = process.LocalDrift(X_pos)
+        vol = process.LocalVol(X_pos)
+        F_x = ratio*(1.0 + ((vol*vol/X_pos - drift)*dt - vol*dW)/X_pos)
+        return F_x, ratio*dt, ratio*(dW - vol/X_pos*dt), None
+
+class Milstein(Scheme):
+    def _step(self, process, X: np.ndarray, dt: float, dW: np.ndarray):
+        vol = process.LocalVol(X)
+        return X + process.LocalDrift(X)*dt + vol*dW + 0.5*vol*process.LocalVolDeriv(X)*(dW*dW - dt)
+
+    def _partials(self, process, X: np.ndarray, X_next: np.ndarray, dt: float, dW: np.ndarray):
+        correction = 0.5*(dW*dW - dt)
+        return 1.0, dt, dW + process.LocalVolDeriv(X)*correction, process.LocalVol(X)*correction
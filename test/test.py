@@ -1,13 +1,25 @@
+import itertools
 import unittest
+import numpy as np
 
 import mc_sim.simulation as mc
 import qf.pricing_util.option as opt
 import qf.pricing_util.payoff as pf
 
-from qf.models.blackscholes import BS
-from qf.models.cev import CEV_Opt
+from qf.models.blackscholes import BS, bs_analytical_npv, bs_implied_vol
+from qf.models.cev import CEV_Opt, cev_analytical_npv
+from qf.models.cev_calibration import CEVCalibrator
+from qf.models.nc_chi_squ import nc_chi_squ_cdf, select_nc_chi_squ_cdf
 
-from sde.gbm_process import GBM
+from fdm.fdm import FDM_Generic_CEV
+from fdm.richardson import FDM_Richardson_CEV
+from fdm.adaptive import FDM_Adaptive_CEV
+from fdm.batch import FDM_Batch_CEV
+from sde.gbm_process import GBM, SimGBM
+from sde.scheme import Euler, LogEuler, Milstein
+from sde.cev_process import CEV as CEVProcess, CEVExact
+from mc_sim.variance_reduction import bs_control_variate, ReplayedNormals
+from mc_sim.mlmc import MLMCSimulation
 
 class PayOffMethods(unittest.TestCase):
     def test_payoff_put(self):
@@ -40,7 +52,19 @@ class PayOffMethods(unittest.TestCase):
 
 class SimulationMethods(unittest.TestCase):
 
+    def test_npv_cashflow_index(self):
+        test_instrument = BS(spot=100.0, sig=0.2, r=0.05, option=opt.EuropeanOption(pf.PayOffPut(strike=100.0), expiry=0.7))
+        #0.1*7 is not exactly 0.7
+        times = np.arange(1, 11)*0.1
+        values = np.tile(np.linspace(90.0, 110.0, 5)[:, None], (1, 10))
+        npv = test_instrument.NPV(times, values)
+        self.assertEqual(npv.shape, (5,))
+        np.testing.assert_allclose(npv, np.maximum(100.0 - values[:, 6], 0.0)*np.exp(-0.05*0.7))
+        with self.assertRaises(AssertionError):
+            test_instrument.NPV(np.arange(1, 11)*0.15, values)
+
     def test_simulation_GBM(self):
+        np.random.seed(1)
         #configure the simulation parameters
         config = mc.SimulationConfig(numberSimus=10000,
                                   snapshotsims=10000,
@@ -77,6 +101,328 @@ class SimulationMethods(unittest.TestCase):
 
         self.assertTrue(lower_bound_est <= test_instrument.Analytical_NPV() <= upper_bound_est)
 
+    def test_simulation_blocks(self):
+        np.random.seed(1)
+        config = mc.SimulationConfig(numberSimus=20000,
+                                  snapshotsims=20000,
+                                  CI=0.95,
+                                  goal=0.01,
+                                  blocksize=5000
+                                  )
+
+        test_instrument = CEV_Opt(spot=30.0,
+                          sig=0.2,
+                          beta=1.9999,
+                          r=0.05,
+                          q=0.0,
+                          option=opt.EuropeanOption(pf.PayOffCall(strike=30.0), expiry=1)
+                          )
+
+        analytical_npv = test_instrument.Analytical_NPV()
+
+        #stepped processes, all paths in a block stepped together
+        for process in [CEVProcess(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol, power=test_instrument.Power),
+                        SimGBM(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol)]:
+            mapping = mc.SimMapping(underlying_process=process, mkt_instrument=test_instrument)
+            sim = mc.Simulation(simconfig=config, simmapping=mapping)
+
+            sim_status, sim_snapshot = sim.run()
+            self.assertEqual(sim_snapshot[0], 20000)
+            #discretisation bias of the Euler scheme is small compared to the CI width here
+            self.assertTrue(abs(sim_snapshot[1] - analytical_npv) <= sim_snapshot[2])
+
+    # blocks draw from their own seeded streams, a parallel run reproduces the serial run exactly
+    def test_simulation_parallel(self):
+        test_instrument = BS(spot=100,
+                          sig=0.5,
+                          r=0.05,
+                          option=opt.EuropeanOption(pf.PayOffCall(strike=110), expiry=0.5)
+                          )
+        mapping = mc.SimMapping(underlying_process=SimGBM(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol),
+                                mkt_instrument=test_instrument)
+
+        snapshots = []
+        for workers in [None, 2, 2]:
+            config = mc.SimulationConfig(numberSimus=20000, goal=0.01, blocksize=2500, workers=workers, seed=42)
+            sim_status, sim_snapshot = mc.Simulation(simconfig=config, simmapping=mapping).run()
+            snapshots.append(sim_snapshot)
+
+        self.assertEqual(snapshots[0][0], 20000)
+        self.assertTrue(np.allclose(snapshots[0], snapshots[1], rtol=1e-12))
+        self.assertTrue(np.array_equal(snapshots[1], snapshots[2]))
+        self.assertTrue(abs(snapshots[1][1] - test_instrument.Analytical_NPV()) <= snapshots[1][2])
+
+    def test_simulation_threads(self):
+        test_instrument = BS(spot=100,
+                          sig=0.5,
+                          r=0.05,
+                          option=opt.EuropeanOption(pf.PayOffCall(strike=110), expiry=0.5)
+                          )
+        mapping = mc.SimMapping(underlying_process=GBM(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol),
+                                mkt_instrument=test_instrument)
+        config = mc.SimulationConfig(numberSimus=40000, goal=0.01, blocksize=5000, threads=3, seed=7)
+        sim_status, sim_snapshot = mc.Simulation(simconfig=config, simmapping=mapping).run()
+
+        self.assertEqual(sim_snapshot[0], 40000)
+        self.assertTrue(abs(sim_snapshot[1] - test_instrument.Analytical_NPV()) <= sim_snapshot[2])
+
+    # exact terminal draws, one transition per path, no discretisation bias
+    def test_simulation_CEV_exact(self):
+        test_instrument = CEV_Opt(spot=30.0,
+                          sig=0.2*(30.0**0.25),
+                          beta=1.5,
+                          r=0.05,
+                          q=0.0,
+                          option=opt.EuropeanOption(pf.PayOffPut(strike=32.0), expiry=1),
+                          cdf_tol=1e-10
+                          )
+        process = CEVExact(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol, power=test_instrument.Power)
+        times, values = process.Xt_paths(test_instrument.Spot, np.array([0.25, 1.0]), 10000, np.random.default_rng(3))
+        self.assertEqual(values.shape, (10000, 2))
+        self.assertTrue(np.all(values >= 0.0))
+
+        mapping = mc.SimMapping(underlying_process=process, mkt_instrument=test_instrument)
+        config = mc.SimulationConfig(numberSimus=200000, goal=0.01, blocksize=50000, seed=11)
+        sim_status, sim_snapshot = mc.Simulation(simconfig=config, simmapping=mapping).run()
+
+        self.assertTrue(abs(sim_snapshot[1] - test_instrument.Analytical_NPV()) <= sim_snapshot[2])
+
+    def test_simulation_variance_reduction(self):
+        test_instrument = CEV_Opt(spot=100.0,
+                          sig=0.2*(100.0**0.2),
+                          beta=1.6,
+                          r=0.05,
+                          q=0.0,
+                          option=opt.EuropeanOption(pf.PayOffPut(strike=100.0), expiry=1),
+                          cdf_tol=1e-10
+                          )
+        process = CEVProcess(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol, power=test_instrument.Power,
+                             scheme=LogEuler(), nbSteps=50)
+        config = mc.SimulationConfig(numberSimus=20000, goal=0.0, blocksize=5000, seed=3)
+
+        antithetic = mc.SimMapping(underlying_process=process, mkt_instrument=test_instrument, antithetic=True)
+        sim_status, sim_snapshot = mc.Simulation(simconfig=config, simmapping=antithetic).run()
+        self.assertEqual(sim_snapshot[0], 10000)
+        self.assertTrue(antithetic.VarianceReductionFactor > 1.0)
+
+        controlled = mc.SimMapping(underlying_process=process, mkt_instrument=test_instrument, antithetic=True,
+                                   control_variate=bs_control_variate(test_instrument, process))
+        sim_status, sim_snapshot = mc.Simulation(simconfig=config, simmapping=controlled).run()
+        self.assertTrue(controlled.VarianceReductionFactor > 100.0)
+        self.assertTrue(abs(sim_snapshot[1] - test_instrument.Analytical_NPV()) <= sim_snapshot[2])
+
+        #the block moments come back from the worker processes, a rerun starts from a reset
+        serial_factor = antithetic.VarianceReductionFactor
+        config = mc.SimulationConfig(numberSimus=20000, goal=0.0, blocksize=5000, workers=2, seed=3)
+        for _ in range(2):
+            mc.Simulation(simconfig=config, simmapping=antithetic).run()
+            self.assertAlmostEqual(antithetic.VarianceReductionFactor, serial_factor, places=10)
+
+    def test_simulation_qmc(self):
+        test_instrument = BS(spot=100.0,
+                          sig=0.2,
+                          r=0.05,
+                          option=opt.EuropeanOption(pf.PayOffCall(strike=100.0), expiry=1)
+                          )
+        process = SimGBM(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol, scheme=LogEuler(), nbSteps=16)
+        mapping = mc.SimMapping(underlying_process=process, mkt_instrument=test_instrument, qmc=True)
+        config = mc.SimulationConfig(numberSimus=16*4096, goal=0.0, blocksize=4096, seed=5)
+        sim_status, sim_snapshot = mc.Simulation(simconfig=config, simmapping=mapping).run()
+
+        #16 randomised QMC replications, plain MC with the same paths would give a CI width of about 0.2
+        self.assertEqual(sim_snapshot[0], 16)
+        self.assertTrue(sim_snapshot[2] < 0.01)
+        self.assertTrue(abs(sim_snapshot[1] - test_instrument.Analytical_NPV()) <= sim_snapshot[2])
+
+    def test_simulation_mlmc(self):
+        test_instrument = CEV_Opt(spot=100.0,
+                          sig=0.2*(100.0**0.2),
+                          beta=1.6,
+                          r=0.05,
+                          q=0.0,
+                          option=opt.EuropeanOption(pf.PayOffPut(strike=100.0), expiry=1),
+                          cdf_tol=1e-10
+                          )
+        process = CEVProcess(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol, power=test_instrument.Power,
+                             scheme=Euler(boundary='absorb'))
+        mapping = mc.SimMapping(underlying_process=process, mkt_instrument=test_instrument)
+        config = mc.SimulationConfig(numberSimus=10**7, goal=0.02, blocksize=10**5, seed=1)
+        mlmc = MLMCSimulation(simconfig=config, simmapping=mapping)
+        sim_status, sim_snapshot = mlmc.run()
+
+        self.assertTrue(sim_status)
+        self.assertTrue(sim_snapshot[2] <= 0.02)
+        self.assertTrue(abs(sim_snapshot[1] - test_instrument.Analytical_NPV()) <= 3.0*sim_snapshot[2])
+        #the corrections are much cheaper to estimate than the coarse level
+        level_stats = mlmc.LevelStats
+        self.assertTrue(np.all(level_stats[1:, 3] < 0.01*level_stats[0, 3]))
+        self.assertTrue(np.all(level_stats[1:, 1] < level_stats[0, 1]))
+
+    def test_simulation_greeks(self):
+        test_instrument = CEV_Opt(spot=100.0,
+                          sig=0.2*(100.0**0.2),
+                          beta=1.6,
+                          r=0.05,
+                          q=0.0,
+                          option=opt.EuropeanOption(pf.PayOffPut(strike=100.0), expiry=1),
+                          cdf_tol=1e-12
+                          )
+        process = CEVProcess(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol, power=test_instrument.Power,
+                             scheme=LogEuler(), nbSteps=25)
+        config = mc.SimulationConfig(numberSimus=50000, goal=0.0, blocksize=25000, seed=2)
+
+        def npv(spot = 100.0, sig = test_instrument.Q_vol, beta = 1.6):
+            return cev_analytical_npv('put', spot, 100.0, 1.0, sig, beta, 0.05, 0.0, 'scipy', 1e-12)
+        h = 1e-3
+        expected = {'delta': (npv(spot=100.0 + h) - npv(spot=100.0 - h))/(2.0*h),
+                    'gamma': (npv(spot=100.1) - 2.0*npv() + npv(spot=99.9))/0.01,
+                    'vega': (npv(sig=test_instrument.Q_vol + h) - npv(sig=test_instrument.Q_vol - h))/(2.0*h),
+                    'beta': (npv(beta=1.6 + h) - npv(beta=1.6 - h))/(2.0*h)}
+        #the greeks are drawn with the normals of the mapping, antithetic pairs included
+        for antithetic in [False, True]:
+            mapping = mc.SimMapping(underlying_process=process, mkt_instrument=test_instrument, antithetic=antithetic)
+            simulation = mc.Simulation(simconfig=config, simmapping=mapping, greeks=True)
+            simulation.run()
+            greeks = simulation.Greeks
+            for name, value in expected.items():
+                self.assertTrue(abs(greeks[name][1] - value) <= greeks[name][2], name)
+
+        #exact samplers have no tangent paths
+        exact = mc.SimMapping(underlying_process=CEVExact(drift=test_instrument.Q_drift, vol=test_instrument.Q_vol, power=0.8),
+                              mkt_instrument=test_instrument)
+        self.assertRaises(AssertionError, exact.evaluate_greeks_block, 100, np.random.default_rng(2))
+
+    def test_simulation_portfolio(self):
+        process = GBM(drift=0.05, vol=0.2)
+        instruments = [BS(spot=100.0, sig=0.2, r=0.05, option=opt.EuropeanOption(payoff, expiry=expiry))
+                       for payoff in [pf.PayOffCall(strike=90.0), pf.PayOffPut(strike=110.0)] for expiry in [0.5, 1.0]]
+        mapping = mc.PortfolioMapping([mc.SimMapping(underlying_process=process, mkt_instrument=instrument) for instrument in instruments],
+                                      quantities=[1.0, 2.0, -1.0, 1.0])
+        self.assertEqual(mapping.NbSimulatedProcesses, 1)
+
+        config = mc.SimulationConfig(numberSimus=100000, goal=0.0, blocksize=25000, seed=4)
+        sim_status, sim_snapshot = mc.Simulation(simconfig=config, simmapping=mapping).run()
+        self.assertEqual(sim_snapshot.shape, (3, 5))
+
+        expected = np.array([1.0, 2.0, -1.0, 1.0])*np.array([instrument.Analytical_NPV() for instrument in instruments])
+        self.assertTrue(np.all(np.abs(sim_snapshot[1, :-1] - expected) <= sim_snapshot[2, :-1]))
+        self.assertAlmostEqual(sim_snapshot[1, -1], np.sum(sim_snapshot[1, :-1]))
+        self.assertEqual(mapping.Process, None)
+
+        #both expiries are read off one path, log(X_0.5) and log(X_1) have correlation sqrt(0.5)
+        times, values = process.Xt_paths(100.0, np.array([0.5, 1.0]), 100000, np.random.default_rng(4))
+        self.assertTrue(abs(np.corrcoef(np.log(values), rowvar=False)[0, 1] - np.sqrt(0.5)) < 0.01)
+
+        #a calendar spread on one path is far less uncertain than its legs priced apart
+        spread = mc.PortfolioMapping([mc.SimMapping(underlying_process=process, mkt_instrument=instruments[1]),
+                                      mc.SimMapping(underlying_process=process, mkt_instrument=instruments[0])],
+                                     quantities=[1.0, -1.0])
+        sim_status, sim_snapshot = mc.Simulation(simconfig=config, simmapping=spread).run()
+        self.assertTrue(sim_snapshot[2, -1] < 0.75*np.sqrt(np.sum(sim_snapshot[2, :-1]**2)))
+
+    # block sizes and streams are generated lazily, the streams past the first chunk are those of a single spawn
+    def test_block_streams(self):
+        config = mc.SimulationConfig(numberSimus=10**12, blocksize=1000, seed=9)
+        simulation = mc.Simulation(simconfig=config, simmapping=None)
+        self.assertEqual(next(simulation._block_sizes()), 1000)
+        nbSeeds = mc.SEED_CHUNK + 3
+        seeds = list(itertools.islice(simulation._block_seeds(), nbSeeds))
+        expected = np.random.SeedSequence(9).spawn(nbSeeds)
+        self.assertTrue(all(np.array_equal(seed.generate_state(2), other.generate_state(2)) for seed, other in zip(seeds, expected)))
+
+    def test_simstats_merge(self):
+        rng = np.random.default_rng(7)
+        res = rng.normal(loc=3.0, scale=2.0, size=10001)
+
+        #single stores, one block and independently accumulated pieces all agree with the full sample
+        single = mc.SimStats(CI=0.95, snapshotsims=1000, goal=0.01)
+        for r in res:
+            single.Store(r)
+        block = mc.SimStats(CI=0.95, snapshotsims=1000, goal=0.01)
+        block.StoreBlock(res)
+        merged = mc.SimStats(CI=0.95, snapshotsims=1000, goal=0.01)
+        for piece in np.array_split(res, 7):
+            worker = mc.SimStats(CI=0.95, snapshotsims=1000, goal=0.01)
+            worker.StoreBlock(piece)
+            merged.Merge(worker)
+
+        for stats in [single, block, merged]:
+            self.assertEqual(stats.SimsDone, res.shape[0])
+            self.assertAlmostEqual(stats.SimMean, np.mean(res), places=10)
+            self.assertAlmostEqual(stats.SimVariance, np.var(res), places=8)
+
+        #the old positional signature SimStats(numbersimus, CI, snapshotsims, goal) fails loudly
+        with self.assertRaises(TypeError):
+            mc.SimStats(10001, 0.95, 1000, 0.01)
+
+class SchemeMethods(unittest.TestCase):
+
+    # log-Euler is exact for GBM, a single step reproduces the exact draws
+    def test_log_euler_GBM(self):
+        times = np.array([0.75])
+        exact_times, exact = GBM(drift=0.05, vol=0.3).Xt_paths(100.0, times, 1000, np.random.default_rng(5))
+        process = SimGBM(drift=0.05, vol=0.3, scheme=LogEuler(), nbSteps=1)
+        sim_times, stepped = process.Xt_paths(100.0, times, 1000, np.random.default_rng(5))
+        self.assertEqual(sim_times[-1], 0.75)
+        self.assertTrue(np.allclose(stepped, exact))
+
+    def test_observation_grid(self):
+        times = np.array([0.25, 0.7, 1.0])
+        process = SimGBM(drift=0.05, vol=0.3, scheme=LogEuler(), dt=0.3)
+        sim_times, X_t = process.Xt_paths(100.0, times, 1000, np.random.default_rng(5))
+        self.assertEqual(X_t.shape, (1000, 3))
+        self.assertTrue(sim_times is times)
+
+        #the step grid goes through every observation time, the kept values are those of the full path
+        step_times, X_full = process.Xt_paths_full(100.0, times, 1000, np.random.default_rng(5))
+        self.assertEqual(step_times.shape[0], 4)
+        self.assertTrue(np.all(np.isin(times, step_times)))
+        self.assertTrue(np.array_equal(X_full[:, np.isin(step_times, times)], X_t))
+
+        #the cashflow index follows the contents of the grid, not the array object
+        instrument = BS(spot=100.0, sig=0.3, r=0.05, option=opt.EuropeanOption(pf.PayOffCall(strike=100.0), expiry=0.7))
+        self.assertEqual(instrument.CashflowIndex(times.copy())[0], 1)
+        grid = step_times.copy()
+        self.assertEqual(instrument.CashflowIndex(grid)[0], 2)
+        grid[:3] = times
+        self.assertEqual(instrument.CashflowIndex(grid)[0], 1)
+
+    # a Generator is drawn one step at a time, the paths are those of the same normals handed over as one matrix
+    def test_step_normals(self):
+        times = np.array([0.5, 1.0])
+        process = CEVProcess(drift=0.05, vol=2.0, power=0.8, scheme=Milstein(boundary='absorb'), dt=0.01)
+        sim_times, X_t = process.Xt_paths(100.0, times, 1000, np.random.default_rng(5))
+        Z_t = np.random.default_rng(5).standard_normal(size=(100, 1000)).T
+        replay_times, X_replay = process.Xt_paths(100.0, times, 1000, ReplayedNormals([Z_t]))
+        self.assertEqual(X_t.shape, (1000, 2))
+        self.assertTrue(np.array_equal(X_t, X_replay))
+
+    def test_iter_blocks(self):
+        times = np.array([0.5, 1.0])
+        process = SimGBM(drift=0.05, vol=0.3, dt=0.1)
+        blocks = list(process.iter_blocks(100.0, times, 300, nbPaths=1000, rng=np.random.default_rng(5)))
+        self.assertEqual([values.shape for block_times, values in blocks], [(300, 2), (300, 2), (300, 2), (100, 2)])
+
+        #one generator per block, the stream is open ended without nbPaths
+        stream = process.iter_blocks(100.0, times, 300, rng=(np.random.default_rng(seed) for seed in range(10)))
+        first_times, first = next(stream)
+        self.assertTrue(np.array_equal(first, process.Xt_paths(100.0, times, 300, np.random.default_rng(0))[1]))
+
+    def test_CEV_boundaries(self):
+        times = np.array([1.0])
+        for scheme in [Euler(boundary='absorb'), Euler(boundary='reflect'), Milstein(boundary='absorb'), LogEuler()]:
+            process = CEVProcess(drift=0.05, vol=1.0, power=0.25, scheme=scheme, dt=0.02)
+            sim_times, X_t = process.Xt_paths_full(1.0, times, 5000, np.random.default_rng(2))
+            self.assertEqual(X_t.shape, (5000, 50))
+            self.assertTrue(np.all(X_t >= 0.0))
+
+        #absorbed paths stay at zero
+        process = CEVProcess(drift=0.05, vol=1.0, power=0.25, scheme=Euler(boundary='absorb'), dt=0.02)
+        sim_times, X_t = process.Xt_paths_full(1.0, times, 5000, np.random.default_rng(2))
+        absorbed = X_t[:, :-1] == 0.0
+        self.assertTrue(np.any(absorbed))
+        self.assertTrue(np.all(X_t[:, 1:][absorbed] == 0.0))
+
 class CEV(unittest.TestCase):
 
     # CEV price for European Option should converge to BS for beta -> 2 from below
@@ -115,6 +461,259 @@ class CEV(unittest.TestCase):
 
         self.assertTrue(diff <= max_allowed_diff)
 
+    # array pricers broadcast over spot, strike and beta and agree with the instrument classes
+    def test_analytical_arrays(self):
+        spots = np.array([25.0, 30.0, 35.0])[:, None]
+        strikes = np.array([28.0, 32.0])[None, :]
+        betas = np.array([1.5, 1.9999])[:, None, None]
+        cev_prices = cev_analytical_npv('call', spots, strikes, 1.0, 0.2, betas, 0.05, 0.02)
+        bs_prices = bs_analytical_npv('put', spots, strikes, 1.0, 0.2, 0.05, 0.02)
+        self.assertEqual(cev_prices.shape, (2, 3, 2))
+        self.assertEqual(bs_prices.shape, (3, 2))
+
+        for i, beta in enumerate(betas.ravel()):
+            for j, S in enumerate(spots.ravel()):
+                for l, K in enumerate(strikes.ravel()):
+                    call = opt.EuropeanOption(pf.PayOffCall(strike=K), expiry=1.0)
+                    put = opt.EuropeanOption(pf.PayOffPut(strike=K), expiry=1.0)
+                    inst_CEV = CEV_Opt(spot=S, sig=0.2, beta=beta, r=0.05, q=0.02, option=call)
+                    inst_BS = BS(spot=S, sig=0.2, r=0.05, q=0.02, option=put)
+                    self.assertAlmostEqual(cev_prices[i, j, l], inst_CEV.Analytical_NPV(), places=8)
+                    self.assertAlmostEqual(bs_prices[j, l], inst_BS.Analytical_NPV(), places=8)
+
+        #put-call parity with a dividend yield
+        bs_calls = bs_analytical_npv('call', spots, strikes, 1.0, 0.2, 0.05, 0.02)
+        parity = spots*np.exp(-0.02) - strikes*np.exp(-0.05)
+        self.assertTrue(np.allclose(bs_calls - bs_prices, parity))
+
+    def test_nc_chi_squ_backends(self):
+        z = np.array([0.5, 4.0, 12.0, 150.0])
+        k = np.array([1.2, 5.0, 2.0, 22.0])
+        v = np.array([0.0, 1.5, 10.0, 120.0])
+        exact = nc_chi_squ_cdf(z, k, v, backend='scipy')
+        self.assertTrue(np.allclose(nc_chi_squ_cdf(z, k, v, backend='series', tol=1e-13), exact, rtol=0.0, atol=1e-12))
+        self.assertTrue(np.allclose(nc_chi_squ_cdf(z, k, v), exact, rtol=0.0, atol=3*10**-2))
+
+        self.assertEqual(select_nc_chi_squ_cdf(1e-1), 'sankaran')
+        self.assertEqual(select_nc_chi_squ_cdf(1e-8), 'scipy')
+        self.assertEqual(select_nc_chi_squ_cdf(1e-14), 'series')
+        self.assertRaises(ValueError, select_nc_chi_squ_cdf, 1e-16)
+
+    # small beta, the backends picked from a tolerance agree with each other
+    def test_analytical_CEV_cdf_tolerance(self):
+        option = opt.EuropeanOption(pf.PayOffPut(strike=40.0), expiry=0.5)
+        prices = []
+        for cdf_tol in [1e-8, 1e-13]:
+            inst_CEV = CEV_Opt(spot=40.0, sig=1.2, beta=0.5, r=0.05, q=0.0, option=option, cdf_tol=cdf_tol)
+            prices.append(inst_CEV.Analytical_NPV())
+        self.assertAlmostEqual(prices[0], prices[1], places=8)
+
+    def test_bs_implied_vol(self):
+        strikes = np.linspace(60.0, 140.0, 9)
+        vols = np.linspace(0.1, 0.5, 9)
+        prices = bs_analytical_npv('put', 100.0, strikes, 0.75, vols, 0.03, 0.01)
+        np.testing.assert_allclose(bs_implied_vol('put', prices, 100.0, strikes, 0.75, 0.03, 0.01), vols, atol=1e-8)
+        self.assertTrue(np.isnan(bs_implied_vol('call', 150.0, 100.0, 100.0, 1.0, 0.03)))
+
+    def test_calibration_CEV(self):
+        strikes, expiries = np.meshgrid(np.linspace(70.0, 130.0, 20), np.linspace(0.1, 2.0, 10))
+        strikes = strikes.ravel()
+        expiries = expiries.ravel()
+        payoff_types = np.where(strikes < 100.0, 'put', 'call')
+        calibrator = CEVCalibrator(spot=100.0, r=0.03, q=0.01)
+        prices = calibrator.model_prices(payoff_types, strikes, expiries, 0.25*(100.0**0.3), 1.4)
+
+        sig, beta = calibrator.calibrate(payoff_types, strikes, expiries, prices=prices)
+        self.assertAlmostEqual(sig, 0.25*(100.0**0.3), 6)
+        self.assertAlmostEqual(beta, 1.4, 6)
+
+        #implied vol quotes, refit from the previous parameters
+        vols = np.where(payoff_types == 'call', bs_implied_vol('call', prices, 100.0, strikes, expiries, 0.03, 0.01),
+                        bs_implied_vol('put', prices, 100.0, strikes, expiries, 0.03, 0.01))
+        evaluations = calibrator.NbEvaluations
+        sig, beta = calibrator.calibrate(payoff_types, strikes, expiries, vols=vols)
+        self.assertAlmostEqual(beta, 1.4, 6)
+        self.assertTrue(calibrator.NbEvaluations - evaluations < 5)
+
+class FDM(unittest.TestCase):
+
+    def _cev_put(self, spot):
+        option = opt.EuropeanOption(pf.PayOffPut(strike=40.0), expiry=0.5)
+        return CEV_Opt(spot=spot, sig=0.2, beta=1.9999, r=0.05, q=0.0, option=option)
+
+    def test_fdm_CEV_put(self):
+        for S in [30.0, 40.0, 50.0]:
+            inst_CEV = self._cev_put(S)
+            engine = FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=100, Nj=100, theta=0.5)
+            engine.rollback()
+            self.assertTrue(abs(engine.result() - inst_CEV.Analytical_NPV()) <= 5*10**-3)
+
+    def test_fdm_price_curve(self):
+        spots = np.arange(20.0, 61.0, 2.0)
+        inst_CEV = self._cev_put(40.0)
+        engine = FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=200, Nj=200, theta=0.5, spots=spots)
+        engine.rollback()
+        prices = engine.results(spots)
+
+        self.assertEqual(prices.shape, spots.shape)
+        with self.assertRaises(AssertionError):
+            engine.results(engine.Nodes[-1] + 1.0)
+        for S, price in zip(spots, prices):
+            self.assertTrue(abs(price - self._cev_put(S).Analytical_NPV()) <= 2*10**-3)
+
+    # the sinh grid concentrated at the strike reaches the uniform accuracy with a quarter of the nodes
+    def test_fdm_sinh_grid(self):
+        for S in [30.0, 40.0, 50.0]:
+            inst_CEV = self._cev_put(S)
+            engine = FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=100, Nj=25, theta=0.5, grid='sinh')
+            engine.rollback()
+            self.assertTrue(np.all(np.diff(engine.Nodes) > 0.0))
+            self.assertEqual(engine.Nodes[0], 0.0)
+            self.assertTrue(abs(engine.result() - inst_CEV.Analytical_NPV()) <= 5*10**-3)
+
+        #fine at the strike and at the spot, a zero spot weight only concentrates at the strike
+        inst_CEV = self._cev_put(30.0)
+        def spacing(engine, level):
+            return np.diff(engine.Nodes)[np.searchsorted(engine.Nodes, level) - 1]
+        strike_only = FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=20, Nj=50, theta=0.5, grid='sinh', spot_weight=0.0)
+        two_centres = FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=20, Nj=50, theta=0.5, grid='sinh')
+        self.assertTrue(spacing(two_centres, 30.0) < 0.7*spacing(strike_only, 30.0))
+        self.assertTrue(spacing(two_centres, 40.0) < spacing(two_centres, 35.0))
+        self.assertEqual(two_centres.Nodes.shape[0], 101)
+
+    # few Crank-Nicolson steps on a fine grid: the kink makes gamma oscillate, implicit half steps at the start damp it
+    def test_fdm_rannacher(self):
+        inst_CEV = self._cev_put(40.0)
+        for rannacher_steps, positive in [(0, False), (2, True)]:
+            engine = FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=10, Nj=200, theta=0.5, rannacher_steps=rannacher_steps)
+            engine.rollback()
+            x = engine.Nodes
+            gamma = np.gradient(np.gradient(engine.results(x), x), x)[(x > 35.0) & (x < 45.0)]
+            self.assertEqual(bool(np.all(gamma > 0.0)), positive)
+        self.assertTrue(abs(engine.result() - inst_CEV.Analytical_NPV()) <= 5*10**-3)
+
+    def test_fdm_richardson(self):
+        for S in [30.0, 40.0, 50.0]:
+            inst_CEV = self._cev_put(S)
+            engine = FDM_Richardson_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=20, Nj=20, levels=3)
+            engine.rollback()
+            error = abs(engine.result() - inst_CEV.Analytical_NPV())
+            self.assertTrue(error <= 10**-5)
+            self.assertTrue(error <= max(5.0*engine.ErrorEstimate, 10**-6))
+            self.assertEqual(engine.level_results(S).shape, (3,))
+
+    # the space error dominates, the driver refines Nj further than N and stops once the tolerance is met
+    def test_fdm_adaptive(self):
+        for beta in [1.9999, 0.5]:
+            option = opt.EuropeanOption(pf.PayOffPut(strike=40.0), expiry=0.5)
+            inst_CEV = CEV_Opt(spot=36.0, sig=0.2*40.0**(1.0 - beta/2.0), beta=beta, r=0.05, q=0.0, option=option, cdf_tol=1e-12)
+            engine = FDM_Adaptive_CEV(beta=beta, mkt_instrument=inst_CEV, r=0.05, tolerance=1e-4)
+            self.assertTrue(engine.rollback())
+            N, Nj = engine.Grid
+            self.assertTrue(Nj > N)
+            self.assertTrue(engine.ErrorEstimate <= 1e-4)
+            self.assertTrue(abs(engine.result() - inst_CEV.Analytical_NPV()) <= 2e-4)
+            self.assertEqual(engine.History.shape[1], 5)
+
+    # a ladder over strikes, betas, expiries, calls and puts, uniform grids of different sizes and Rannacher sinh grids
+    def test_fdm_batch(self):
+        instruments = []
+        for m, strike in enumerate(np.linspace(30.0, 50.0, 12)):
+            beta = [1.9999, 1.5, 1.0][m % 3]
+            payoff = pf.PayOffPut(strike=strike) if m % 2 else pf.PayOffCall(strike=strike)
+            option = opt.EuropeanOption(payoff, expiry=0.5 + 0.25*(m % 4))
+            instruments.append(CEV_Opt(spot=40.0, sig=0.2*40.0**(1.0 - beta/2.0), beta=beta, r=0.05, q=0.0, option=option))
+
+        for engine_kwargs in [{}, {'grid': 'sinh', 'rannacher_steps': 2, 'average_payoff': True}]:
+            batch = FDM_Batch_CEV(instruments, r=0.05, N=50, Nj=50, theta=0.5, **engine_kwargs)
+            batch.rollback()
+            prices = batch.results()
+            self.assertEqual(prices.shape, (12,))
+            for price, instrument in zip(prices, instruments):
+                engine = FDM_Generic_CEV(beta=instrument.Power*2.0, mkt_instrument=instrument, r=0.05, N=50, Nj=50, theta=0.5, **engine_kwargs)
+                engine.rollback()
+                self.assertAlmostEqual(price, engine.result(), places=10)
+
+    # Cox-Ross-Rubinstein American put, the beta = 2 reference
+    def _crr_american_put(self, spot, strike, expiry, sig, r, nbSteps):
+        dt = expiry/nbSteps
+        up = np.exp(sig*np.sqrt(dt))
+        prob = (np.exp(r*dt) - 1.0/up)/(up - 1.0/up)
+        values = np.maximum(strike - spot*up**np.arange(nbSteps, -nbSteps - 1, -2), 0.0)
+        for step in range(nbSteps, 0, -1):
+            continuation = np.exp(-r*dt)*(prob*values[:-1] + (1.0 - prob)*values[1:])
+            values = np.maximum(continuation, strike - spot*up**np.arange(step - 1, -step, -2))
+        return values[0]
+
+    def test_fdm_american_put(self):
+        for S in [34.0, 40.0, 46.0]:
+            option = opt.AmericanOption(pf.PayOffPut(strike=40.0), expiry=0.5)
+            inst_CEV = CEV_Opt(spot=S, sig=0.2, beta=1.9999, r=0.05, q=0.0, option=option)
+            engine = FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=200, Nj=200, theta=0.5, grid='sinh', rannacher_steps=2)
+            engine.rollback()
+            self.assertTrue(abs(engine.result() - self._crr_american_put(S, 40.0, 0.5, 0.2, 0.05, 5000)) <= 10**-3)
+            self.assertTrue(engine.result() > self._cev_put(S).Analytical_NPV())
+
+        #the put is exercised below a boundary that rises to the strike at expiry
+        times, boundary = engine.ExerciseBoundary
+        self.assertEqual(times.shape, boundary.shape)
+        self.assertFalse(np.any(np.isnan(boundary)))
+        self.assertTrue(np.all(np.diff(boundary) >= 0.0))
+        self.assertTrue((boundary[0] > 30.0) & (boundary[-1] < 40.0))
+
+    # no early exercise for a call without dividends or a put at r = 0, the boundary is NaN at every step
+    def test_fdm_american_not_exercised(self):
+        for payoff, r in [(pf.PayOffCall(strike=40.0), 0.05), (pf.PayOffPut(strike=40.0), 0.0)]:
+            prices = []
+            for option in [opt.AmericanOption(payoff, expiry=0.5), opt.EuropeanOption(payoff, expiry=0.5)]:
+                inst_CEV = CEV_Opt(spot=40.0, sig=0.2, beta=1.9999, r=r, q=0.0, option=option)
+                engine = FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=r, N=200, Nj=200, theta=0.5, rannacher_steps=2)
+                engine.rollback()
+                prices.append(engine.result())
+                if option.ExerciseStyle == 'american':
+                    times, boundary = engine.ExerciseBoundary
+                    self.assertTrue(np.all(np.isnan(boundary)))
+            self.assertAlmostEqual(prices[0], prices[1], places=12)
+
+    # European <= Bermudan <= American, a Bermudan exercisable at the expiry only is the European
+    def test_fdm_bermudan_put(self):
+        payoff = pf.PayOffPut(strike=40.0)
+        options = [opt.EuropeanOption(payoff, expiry=0.5),
+                   opt.BermudanOption(payoff, exercise_times=[0.5]),
+                   opt.BermudanOption(payoff, exercise_times=np.arange(1, 7)/12.0),
+                   opt.AmericanOption(payoff, expiry=0.5)]
+        engines = []
+        for option in options:
+            inst_CEV = CEV_Opt(spot=40.0, sig=0.2, beta=1.9999, r=0.05, q=0.0, option=option)
+            engines.append(FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=120, Nj=100, theta=0.5))
+            engines[-1].rollback()
+        prices = [engine.result() for engine in engines]
+        self.assertAlmostEqual(prices[0], prices[1], places=12)
+        self.assertTrue((prices[1] < prices[2]) & (prices[2] < prices[3]))
+        #the monthly Bermudan is exercised on the 5 dates before the expiry only
+        times, boundary = engines[2].ExerciseBoundary
+        np.testing.assert_allclose(times[~np.isnan(boundary)], np.arange(1, 6)/12.0, atol=0.5*0.5/120)
+
+        #exercise dates between time steps are not moved to the nearest step
+        inst_CEV = CEV_Opt(spot=40.0, sig=0.2, beta=1.9999, r=0.05, q=0.0, option=options[2])
+        self.assertRaises(AssertionError, FDM_Generic_CEV, beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=100, Nj=100, theta=0.5)
+        np.testing.assert_array_equal(options[3].ExerciseTimes, np.array([0.0, 0.5]))
+
+    # a time dependent local vol that happens to be constant rebuilds the operator every step, same price
+    def test_fdm_time_dependent_coefficients(self):
+        class TimeDependentFDM(FDM_Generic_CEV):
+            def _sig_func(self, x, t):
+                return self._sig*(x**(self._cev_beta/2.0)) + 0.0*t
+
+        inst_CEV = self._cev_put(40.0)
+        engine = FDM_Generic_CEV(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=50, Nj=50, theta=0.5)
+        engine_t = TimeDependentFDM(beta=inst_CEV.Power*2.0, mkt_instrument=inst_CEV, r=0.05, N=50, Nj=50, theta=0.5)
+        self.assertTrue(engine.TimeHomogeneous)
+        self.assertFalse(engine_t.TimeHomogeneous)
+        engine.rollback()
+        engine_t.rollback()
+        self.assertAlmostEqual(engine.result(), engine_t.result(), places=12)
+
 if __name__ == "__main__":
     unittest.main(argv=[''], verbosity=2, exit=False)
 